@@ -3,7 +3,7 @@ import bpy  # type: ignore
 bl_info = {
     "name": "RBR Track Addon",
     "description": "Importer / exporter for RBR's native track format",
-    "version": (0, 3, 1),  # Don't forget to update migrations!
+    "version": (0, 3, 2),  # Don't forget to update migrations!
     "blender": (4, 0, 0),
     "author": "Tom Smalley, WorkerBee (reverse engineering)",
     "url": "https://github.com/RichardBurnsRally/blender-rbr-track-addon",
@@ -127,6 +127,10 @@ def load_post_handler(
             bpy.context.scene.rbr_addon_version = str((0, 3, 0))
         elif version == str((0, 3, 0)):
             bpy.context.scene.rbr_addon_version = str((0, 3, 1))
+        elif version == str((0, 3, 1)):
+            # Material map corners packed into bounds
+            physical_material_editor.properties.migrate_all_material_maps_bounds()
+            bpy.context.scene.rbr_addon_version = str((0, 3, 2))
         elif version == str(current_version):
             # current version, stop trying to find migrations
             if iteration > 0:
@@ -50,8 +50,7 @@ class RBRMaterialMapsData:
 
     @staticmethod
     def from_blender(source: RBRMaterialMaps) -> RBRMaterialMapsData:
-        (x1, y1) = source.position_1
-        (x2, y2) = source.position_2
+        (x1, y1, x2, y2) = source.get_bounds()
         return RBRMaterialMapsData(
             position_1=(x1, y1),
             position_2=(x2, y2),
@@ -141,17 +141,17 @@ class RBRExportTextureOracle:
                 continue
 
             # Walk to each texture
-            (diffuse_1, diffuse_1_uv, uv_velocity_1) = shader.walk_to_texture(
+            (
+                (diffuse_1, diffuse_1_uv, uv_velocity_1),
+                (diffuse_2, diffuse_2_uv, uv_velocity_2),
+                (specular, specular_uv, uv_velocity_spec),
+            ) = shader.walk_to_textures(
                 material=material,
-                input_name="Diffuse Texture 1",
-            )
-            (diffuse_2, diffuse_2_uv, uv_velocity_2) = shader.walk_to_texture(
-                material=material,
-                input_name="Diffuse Texture 2",
-            )
-            (specular, specular_uv, uv_velocity_spec) = shader.walk_to_texture(
-                material=material,
-                input_name="Specular Texture",
+                input_names=[
+                    "Diffuse Texture 1",
+                    "Diffuse Texture 2",
+                    "Specular Texture",
+                ],
             )
 
             self.logger.debug(
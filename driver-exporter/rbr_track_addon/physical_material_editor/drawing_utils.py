@@ -4,6 +4,11 @@ import bpy  # type: ignore
 import gpu  # type: ignore
 from gpu_extras.batch import batch_for_shader  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
+
+from rbr_track_formats.common import NumpyArray
+
+from .properties import material_maps_bounds
 
 FONT_ID = 0
 
@@ -21,6 +26,31 @@ def draw_rect_view(
     draw_rect_region(Vector((p0x, p0y)), Vector((p1x, p1y)), bg_color, border_color)
 
 
+def view_to_region_transform(
+    region: bpy.types.Region,
+) -> Tuple[NumpyArray, NumpyArray]:
+    """The view to region mapping is affine, so sample it once and return
+    (offset, scale) such that region = offset + scale * view"""
+    # view_to_region rounds to whole pixels, region_to_view doesn't, so sample
+    # the inverse mapping at opposite corners of the region.
+    size = np.array((max(region.width, 1), max(region.height, 1)), dtype=float)
+    view_0 = np.array(region.view2d.region_to_view(0, 0))
+    view_1 = np.array(region.view2d.region_to_view(size[0], size[1]))
+    scale = size / (view_1 - view_0)
+    return (-view_0 * scale, scale)
+
+
+def material_maps_region_rects(
+    region: bpy.types.Region,
+    material_maps: bpy.types.Collection,  # [RBRMaterialMaps]
+) -> NumpyArray:
+    """Get the region space rectangles of all material maps, as a (-1, 4) shape
+    array of (x0, y0, x1, y1)"""
+    view_rects = material_maps_bounds(material_maps)
+    (offset, scale) = view_to_region_transform(region)
+    return np.tile(offset, 2) + np.tile(scale, 2) * view_rects
+
+
 def draw_rect_region(
     p0: Vector,
     p1: Vector,
@@ -42,3 +72,57 @@ def draw_rect_region(
     shader.uniform_float("color", border_color)
     batch = batch_for_shader(shader, "LINE_STRIP", {"pos": lines})
     batch.draw(shader)
+
+
+def quad_triangles(
+    x0: NumpyArray, y0: NumpyArray, x1: NumpyArray, y1: NumpyArray
+) -> NumpyArray:
+    """Two triangles for each of many axis aligned quads, as a (-1, 6, 2)
+    shape array"""
+    bl = np.stack([x0, y0], axis=-1)
+    br = np.stack([x1, y0], axis=-1)
+    tr = np.stack([x1, y1], axis=-1)
+    tl = np.stack([x0, y1], axis=-1)
+    return np.stack([bl, br, tr, bl, tr, tl], axis=1)
+
+
+def draw_rects_region(
+    rects: NumpyArray,
+    bg_colors: NumpyArray,
+    border_color: Tuple[float, float, float, float] = (0, 0, 0, 1),
+) -> None:
+    """Draw many rectangles in region space in one draw call. Borders are
+    drawn as thin quads, so each rectangle's border comes straight after its
+    background, and later rectangles cover earlier ones as they would when
+    drawn one at a time with draw_rect_region.
+
+    rects is a (-1, 4) shape array of (x0, y0, x1, y1), bg_colors is a (-1, 4)
+    shape array of RGBA colors, one for each rectangle.
+    """
+    if len(rects) == 0:
+        return
+    rects = np.asarray(rects, dtype=np.float32)
+    (x0, y0, x1, y1) = (rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3])
+    # Borders 2 pixels wide, centred on the edges like a line of width 2
+    w = 1.0
+    tris = np.concatenate(
+        [
+            quad_triangles(x0, y0, x1, y1),
+            quad_triangles(x0 - w, y0 - w, x1 + w, y0 + w),
+            quad_triangles(x0 - w, y1 - w, x1 + w, y1 + w),
+            quad_triangles(x0 - w, y0 - w, x0 + w, y1 + w),
+            quad_triangles(x1 - w, y0 - w, x1 + w, y1 + w),
+        ],
+        axis=1,
+    ).reshape(-1, 2)
+    n = len(rects)
+    colors = np.empty((n, 30, 4), dtype=np.float32)
+    colors[:, :6] = np.asarray(bg_colors, dtype=np.float32)[:, np.newaxis]
+    colors[:, 6:] = border_color
+    gpu.state.blend_set("ALPHA")
+    shader = gpu.shader.from_builtin("SMOOTH_COLOR")
+    shader.bind()
+    batch = batch_for_shader(
+        shader, "TRIS", {"pos": tris, "color": colors.reshape(-1, 4)}
+    )
+    batch.draw(shader)
@@ -1,14 +1,15 @@
+from collections import deque
 from dataclasses import dataclass
 import enum
-from typing import List, Optional, Set, Tuple
+from typing import Any, List, Optional, Set, Tuple
 
 import bpy  # type: ignore
 import blf  # type: ignore
 import gpu  # type: ignore
 from gpu_extras.batch import batch_for_shader  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
 
-from rbr_track_formats.common import flatten
 from rbr_track_formats.mat import MaterialID
 
 from .. import materials
@@ -43,6 +44,28 @@ class Tool(enum.Enum):
             raise NotImplementedError()
 
 
+def flood_fill_cells(grid: List[List[int]], i: int, j: int) -> List[Tuple[int, int]]:
+    """Find the 4-connected region of cells sharing the value at grid[i][j].
+    This uses an explicit worklist rather than recursion, and tracks visited
+    cells in a bitset so no cell is queued twice."""
+    rows = len(grid)
+    cols = len(grid[0])
+    from_value = grid[i][j]
+    visited = 1 << (i * cols + j)
+    worklist = deque([(i, j)])
+    cells = []
+    while worklist:
+        (ci, cj) = worklist.pop()
+        cells.append((ci, cj))
+        for ni, nj in ((ci + 1, cj), (ci - 1, cj), (ci, cj + 1), (ci, cj - 1)):
+            if 0 <= ni < rows and 0 <= nj < cols:
+                bit = 1 << (ni * cols + nj)
+                if not visited & bit and grid[ni][nj] == from_value:
+                    visited |= bit
+                    worklist.append((ni, nj))
+    return cells
+
+
 @dataclass
 class EditMode(Mode):
     editing_index: int
@@ -53,6 +76,24 @@ class EditMode(Mode):
 
     _tool: Tool = Tool.PAINT
 
+    # Paint material and map rows (Collection[RBRMaterialMapRow]) for the
+    # current stroke, set on left mouse press.
+    _paint_material: Optional[int] = None
+    _paint_rows: Optional[bpy.types.Collection] = None
+
+    # The (editor material maps epoch, number of maps, pointer) which
+    # active_maps was looked up for.
+    _active_maps_key: Optional[Tuple[int, int, int]] = None
+
+    # Active map (RBRMaterialMap) of active_maps, along with the (surface
+    # type, surface age) key it was looked up for. Dropped whenever
+    # active_maps is looked up again.
+    _active_map_cache: Optional[Tuple[Tuple[Any, ...], Any]] = None
+
+    # Batch for the highlighted cell, along with the (cell, view) key it was
+    # built for.
+    _highlight_batch_cache: Optional[Tuple[Tuple[Any, ...], Any]] = None
+
     @property
     def tool(self) -> Tool:
         return self._tool
@@ -63,20 +104,44 @@ class EditMode(Mode):
         self._tool = m
 
     def update_active_maps(self, editor: Editor) -> Optional[Set[str]]:
-        if self.editing_index >= len(editor.material_maps):
+        # Maps can be removed behind the editor's back (e.g. from a script), so
+        # check the index even when nothing seems to have changed.
+        material_maps = editor.material_maps
+        count = len(material_maps)
+        if self.editing_index >= count:
             editor.to_overview_mode()
             return {"PASS_THROUGH"}
-        self.active_maps = editor.material_maps[self.editing_index]
+        active_maps = material_maps[self.editing_index]
+        key = (editor.material_maps_epoch(), count, active_maps.as_pointer())
+        if self._active_maps_key == key:
+            return None
+        self.active_maps = active_maps
+        self._active_maps_key = key
+        self._active_map_cache = None
+        # The rows belong to the old maps
+        self._paint_rows = None
         return None
 
+    def active_map(self) -> Any:
+        """The active map (RBRMaterialMap) of active_maps. This is looked up
+        several times per event, so avoid walking the scene and node tree for
+        it unless something changed."""
+        track_settings = bpy.context.scene.rbr_track_settings
+        key = (
+            track_settings.active_surface_type,
+            track_settings.active_surface_age,
+        )
+        if self._active_map_cache is None or self._active_map_cache[0] != key:
+            self._active_map_cache = (key, self.active_maps.get_active_map())
+        return self._active_map_cache[1]
+
     def draw(
         self,
         editor: Editor,
         region: bpy.types.Region,
     ) -> None:
         self.update_active_maps(editor)
-        (p1x, p1y) = self.active_maps.position_1
-        (p2x, p2y) = self.active_maps.position_2
+        (p1x, p1y, p2x, p2y) = self.active_maps.get_bounds()
         box_bl = Vector(region.view2d.view_to_region(p1x, p1y, clip=False))
         box_tr = Vector(region.view2d.view_to_region(p2x, p2y, clip=False))
 
@@ -87,29 +152,27 @@ class EditMode(Mode):
 
         dx = x1 - x0
         dy = y1 - y0
-        # Draw grid
-        lines = []
-        for i in range(17):
-            multiplier = i / 16.0
-            lines.append(
-                [
-                    (x0 + dx * multiplier, y0),
-                    (x0 + dx * multiplier, y1),
-                ]
-            )
-            lines.append(
-                [
-                    (x0, y0 + dy * multiplier),
-                    (x1, y0 + dy * multiplier),
-                ]
-            )
+        # Draw grid: 17 vertical lines followed by 17 horizontal lines, each
+        # as a pair of points.
+        multipliers = np.linspace(0, 1, 17, dtype=np.float32)
+        grid_xs = x0 + dx * multipliers
+        grid_ys = y0 + dy * multipliers
+        lines = np.empty((68, 2), dtype=np.float32)
+        lines[0:34:2, 0] = grid_xs
+        lines[0:34:2, 1] = y0
+        lines[1:34:2, 0] = grid_xs
+        lines[1:34:2, 1] = y1
+        lines[34::2, 0] = x0
+        lines[34::2, 1] = grid_ys
+        lines[35::2, 0] = x1
+        lines[35::2, 1] = grid_ys
         shader = gpu.shader.from_builtin("UNIFORM_COLOR")
         shader.bind()
         batch = batch_for_shader(
             shader,
             "LINES",
             {
-                "pos": flatten(lines),
+                "pos": lines,
             },
         )
         shader.uniform_float("color", (1, 1, 1, 0.5))
@@ -117,12 +180,12 @@ class EditMode(Mode):
 
         mat_alpha = bpy.context.scene.rbr_material_picker.alpha
 
-        def draw_box(i: int, j: int, px: int = 0, di: int = 1, dj: int = 1) -> None:
+        def box_batch(i: int, j: int, px: int = 0, di: int = 1, dj: int = 1) -> Any:
             mult_i_0 = i / 16.0
             mult_i_1 = (i + di) / 16.0
             mult_j_0 = j / 16.0
             mult_j_1 = (j + dj) / 16.0
-            batch = batch_for_shader(
+            return batch_for_shader(
                 shader,
                 "TRI_FAN",
                 {
@@ -134,11 +197,13 @@ class EditMode(Mode):
                     ]
                 },
             )
-            batch.draw(shader)
+
+        def draw_box(i: int, j: int, px: int = 0, di: int = 1, dj: int = 1) -> None:
+            box_batch(i, j, px, di, dj).draw(shader)
 
         # Draw material map
         (highlight_j, highlight_i) = self.highlight_mat_pixel
-        for i, row in enumerate(self.active_maps.get_active_map().rows):
+        for i, row in enumerate(self.active_map().rows):
             for j, col in enumerate(row.cols):
                 mat_id = MaterialID(col.material_id)
                 rgb = materials.material_id_to_color(mat_id)
@@ -148,15 +213,25 @@ class EditMode(Mode):
                 shader.uniform_float("color", (r, g, b, mat_alpha))
                 draw_box(i, j)
 
+        # The highlight only moves when the hovered cell or the view changes.
+        highlight_key = (highlight_i, highlight_j, x0, y0, dx, dy)
+        if (
+            self._highlight_batch_cache is None
+            or self._highlight_batch_cache[0] != highlight_key
+        ):
+            self._highlight_batch_cache = (
+                highlight_key,
+                box_batch(highlight_i, highlight_j, px=2),
+            )
         shader.uniform_float("color", (1, 1, 1, 0.4))
-        draw_box(highlight_i, highlight_j, px=2)
+        self._highlight_batch_cache[1].draw(shader)
 
         debug = False
         if debug:
             # Debug indices
             wrap_width = round(dx / 16)
             blf.enable(FONT_ID, blf.WORD_WRAP)
-            for i, row in enumerate(self.active_maps.get_active_map().rows):
+            for i, row in enumerate(self.active_map().rows):
                 for j, col in enumerate(row.cols):
                     mat_id = MaterialID(col.material_id)
                     fx = x0 + dx * (j / 16) + 2
@@ -172,36 +247,40 @@ class EditMode(Mode):
                     blf.draw(FONT_ID, mat_id.pretty())
 
     def paint(self, editor: Editor) -> None:
-        self.update_active_maps(editor)
+        # The material can't change during a stroke, so only look it up at
+        # the start of it. The rows are looked up again if the maps change.
+        if self.update_active_maps(editor) is not None:
+            return
+        if self._paint_material is None:
+            self._paint_material = bpy.context.scene.rbr_material_picker.material_id
+        if self._paint_rows is None:
+            self._paint_rows = self.active_map().rows
         (highlight_j, highlight_i) = self.highlight_mat_pixel
-        paint_material = bpy.context.scene.rbr_material_picker.material_id
-        self.active_maps.get_active_map().rows[highlight_i].cols[
+        self._paint_rows[highlight_i].cols[
             highlight_j
-        ].material_id = paint_material
+        ].material_id = self._paint_material
 
     def fill(self, editor: Editor) -> None:
         self.update_active_maps(editor)
         (j, i) = self.highlight_mat_pixel
-        from_mat = self.active_maps.get_active_map().rows[i].cols[j].material_id
-        self.recursive_fill(from_mat, (i, j))
-
-    def recursive_fill(self, from_mat: int, pixel: Tuple[int, int]) -> None:
-        (i, j) = pixel
-        this_mat = self.active_maps.get_active_map().rows[i].cols[j].material_id
         paint_material = bpy.context.scene.rbr_material_picker.material_id
-        if this_mat == paint_material:
+        rows = self.active_map().rows
+        grid = [[col.material_id for col in row.cols] for row in rows]
+        if grid[i][j] == paint_material:
             return
-        if this_mat == from_mat:
-            new_mat = paint_material
-            self.active_maps.get_active_map().rows[i].cols[j].material_id = new_mat
-            if i < 15:
-                self.recursive_fill(from_mat, (i + 1, j))
-            if i > 0:
-                self.recursive_fill(from_mat, (i - 1, j))
-            if j < 15:
-                self.recursive_fill(from_mat, (i, j + 1))
-            if j > 0:
-                self.recursive_fill(from_mat, (i, j - 1))
+        # Only write the cells which change back to blender.
+        for fi, fj in flood_fill_cells(grid, i, j):
+            rows[fi].cols[fj].material_id = paint_material
+
+    def hovered_cell(
+        self, editor: Editor, vx: float, vy: float
+    ) -> Optional[Tuple[int, int]]:
+        # Painting needs every mouse move to be handled.
+        if self.left_mouse_down:
+            return None
+        if self.update_active_maps(editor) is not None:
+            return None
+        return self.active_maps.pixel(vx, vy)
 
     def handle_event(self, editor: Editor, event: bpy.types.Event) -> Set[str]:
         (region, mx, my) = editor.last_mouse_region()
@@ -215,6 +294,8 @@ class EditMode(Mode):
 
         if event.type == "LEFTMOUSE" and event.value == "PRESS":
             self.left_mouse_down = True
+            self._paint_material = None
+            self._paint_rows = None
             if self.tool is Tool.PAINT:
                 self.paint(editor)
             elif self.tool is Tool.FILL:
@@ -224,6 +305,8 @@ class EditMode(Mode):
             return {"RUNNING_MODAL"}
         elif event.type == "LEFTMOUSE" and event.value == "RELEASE":
             self.left_mouse_down = False
+            self._paint_material = None
+            self._paint_rows = None
             return {"RUNNING_MODAL"}
 
         elif event.type == "RIGHTMOUSE":
@@ -232,9 +315,7 @@ class EditMode(Mode):
             if event.value == "RELEASE":
                 (j, i) = self.highlight_mat_pixel
                 ok = bpy.context.scene.rbr_material_picker.set_material_id(
-                    MaterialID(
-                        self.active_maps.get_active_map().rows[i].cols[j].material_id
-                    )
+                    MaterialID(self.active_map().rows[i].cols[j].material_id)
                 )
                 if not ok:
                     editor.report({"WARNING"}, "Can't sample invalid material")
@@ -295,12 +376,7 @@ class EditMode(Mode):
         if self.active_maps is None:
             return []
         (highlight_j, highlight_i) = self.highlight_mat_pixel
-        mat_id_int = (
-            self.active_maps.get_active_map()
-            .rows[highlight_i]
-            .cols[highlight_j]
-            .material_id
-        )
+        mat_id_int = self.active_map().rows[highlight_i].cols[highlight_j].material_id
         mat_id = MaterialID(mat_id_int)
         paint_material = MaterialID(bpy.context.scene.rbr_material_picker.material_id)
         return [
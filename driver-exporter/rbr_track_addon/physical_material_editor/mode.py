@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import List, Set, Tuple
+from typing import List, Optional, Set, Tuple
 
 import bpy  # type: ignore
 
@@ -19,6 +19,16 @@ class Editor:
         """Get the fallback materials"""
         raise NotImplementedError
 
+    def material_maps_epoch(self) -> int:
+        """A counter which changes whenever the material maps collection is
+        replaced, or maps are added or removed."""
+        raise NotImplementedError
+
+    def material_maps_changed(self) -> None:
+        """Signal that maps have been added to or removed from the material
+        maps collection."""
+        raise NotImplementedError
+
     # Mode switching functions
     def to_overview_mode(self) -> None:
         raise NotImplementedError
@@ -48,6 +58,9 @@ class Editor:
 
 
 class Mode:
+    # No instance dict here, so that subclasses can use slots.
+    __slots__ = ()
+
     def draw(
         self,
         editor: Editor,
@@ -63,6 +76,15 @@ class Mode:
     ) -> Set[str]:
         pass
 
+    def hovered_cell(
+        self, editor: Editor, vx: float, vy: float
+    ) -> Optional[Tuple[int, int]]:
+        """The material map cell under the given view space position. Modes
+        which return a cell here are only redrawn on mouse moves when the cell
+        or the hovered maps change. Returning None means every mouse move needs
+        a redraw."""
+        return None
+
     def cursor(self) -> str:
         return "DEFAULT"
 
@@ -3,9 +3,14 @@ from typing import List, Optional, Set
 
 import bpy  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
 
 from .mode import Editor, Mode
-from .drawing_utils import draw_rect_view
+from .drawing_utils import (
+    draw_rect_view,
+    draw_rects_region,
+    material_maps_region_rects,
+)
 
 
 @dataclass
@@ -21,8 +26,9 @@ class NewMode(Mode):
         editor: Editor,
         region: bpy.types.Region,
     ) -> None:
-        for mat in editor.material_maps:
-            draw_rect_view(region, Vector(mat.position_1), Vector(mat.position_2))
+        rects = material_maps_region_rects(region, editor.material_maps)
+        bg_colors = np.tile(np.array([1, 1, 1, 0.2], dtype=np.float32), (len(rects), 1))
+        draw_rects_region(rects, bg_colors)
         if self.start_position is not None:
             (mouse_region, mouse_x, mouse_y) = editor.last_mouse_region()
             if mouse_region == region:
@@ -42,9 +48,11 @@ class NewMode(Mode):
                     self.start_position = None
                 else:
                     material_maps = editor.material_maps.add()
-                    material_maps.position_1 = self.start_position
-                    material_maps.position_2 = cursor_pos_view
+                    (x0, y0) = self.start_position
+                    (x1, y1) = cursor_pos_view
+                    material_maps.bounds = (x0, y0, x1, y1)
                     material_maps.__init__()
+                    editor.material_maps_changed()
                     editor.to_overview_mode()
             return {"RUNNING_MODAL"}
         elif event.type == "ESC" and event.value == "PRESS":
@@ -1,9 +1,10 @@
-from typing import Any, List, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import bpy  # type: ignore
 import blf  # type: ignore
 import gpu  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
 
 from rbr_track_formats import errors
 
@@ -13,7 +14,30 @@ from .edit import EditMode
 from .resize import ResizeMode
 from .new import NewMode
 from .drawing_utils import FONT_ID, draw_rect_region
-from .properties import RBRFallbackMaterials, RBRPropertyNodePointer
+from .properties import (
+    RBRFallbackMaterials,
+    RBRPropertyNodePointer,
+    material_maps_bounds,
+    points_in_bounds,
+)
+
+
+# Bumped whenever blender data is reallocated (load/undo/redo), which leaves
+# the editor holding dangling references.
+blend_data_epoch: int = 0
+
+
+@bpy.app.handlers.persistent  # type: ignore
+def bump_blend_data_epoch(*args: Any) -> None:
+    global blend_data_epoch
+    blend_data_epoch += 1
+
+
+blend_data_epoch_handlers = [
+    bpy.app.handlers.load_post,
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+]
 
 
 def get_region_containing(
@@ -80,6 +104,7 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
 
         bpy.context.workspace.status_text_set(text=status_text_handler)
         self._mode = m
+        self._last_hovered_pixel = None
 
     def to_overview_mode(self) -> None:
         self.mode = OverviewMode()
@@ -111,6 +136,28 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
     def material_maps(self, t: bpy.types.Collection) -> None:
         """Collection[RBRMaterialMaps]"""
         self._material_maps = t
+        self.material_maps_changed()
+
+    # Bumped whenever the material maps change, so modes can cache lookups
+    # into the collection.
+    _material_maps_epoch: int = 0
+
+    def material_maps_epoch(self) -> int:
+        return self._material_maps_epoch
+
+    def material_maps_changed(self) -> None:
+        self._material_maps_epoch += 1
+
+    # The blend_data_epoch which material maps were last looked up in
+    _blend_data_epoch: int = 0
+
+    def refresh_blend_data(self, context: bpy.types.Context) -> Optional[Set[str]]:
+        """Look up the material maps again if blender data was reallocated
+        since the last lookup."""
+        if self._blend_data_epoch == blend_data_epoch:
+            return None
+        self._blend_data_epoch = blend_data_epoch
+        return self.update_active_texture(context)
 
     @property
     def fallback_materials(self) -> RBRFallbackMaterials:
@@ -144,6 +191,11 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
     def last_mouse_region(self) -> Tuple[bpy.types.Region, float, float]:
         return self._last_mouse_region
 
+    # The hovered cell and region from the last event, used to skip redraws
+    # when the mouse moves within a single cell.
+    _last_hovered_pixel: Optional[Tuple[int, int]] = None
+    _last_hovered_region_id: Optional[int] = None
+
     # Maintain a list of maps the mouse is hovered over.
     _hovered_map_indices: List[int] = []
 
@@ -154,14 +206,21 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
         self, region: bpy.types.Region, rx: int, ry: int
     ) -> None:
         (vx, vy) = region.view2d.region_to_view(rx, ry)
-        all_maps = self.material_maps
-        found_indices = []
-        for i, mat in enumerate(all_maps):
-            if mat.point_in_map(vx, vy):
-                found_indices.append(i)
-        self._hovered_map_indices = found_indices
+        # Test all maps at once, rather than going through each map's
+        # properties in turn.
+        bounds = material_maps_bounds(self.material_maps)
+        found = np.flatnonzero(points_in_bounds(vx, vy, bounds))
+        self._hovered_map_indices = found.tolist()
+
+    # Messages are mostly the same from frame to frame, so remember their
+    # dimensions instead of asking blf every redraw. Keyed by (message, size).
+    _text_dimensions_cache: Dict[Tuple[str, int], Tuple[float, float]] = {}
 
     def draw_editor_wrapped(self, context: bpy.types.Context) -> None:
+        # Wait for the next event to look the material maps up again, rather
+        # than drawing dangling references.
+        if self._blend_data_epoch != blend_data_epoch:
+            return
         try:
             self.draw_editor(context)
         except ReferenceError:
@@ -191,7 +250,12 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
         messages = self.mode.messages(self)
         width = 0
         for message in messages:
-            (x, y) = blf.dimensions(FONT_ID, message)
+            key = (message, font_size)
+            dimensions = self._text_dimensions_cache.get(key)
+            if dimensions is None:
+                dimensions = blf.dimensions(FONT_ID, message)
+                self._text_dimensions_cache[key] = dimensions
+            (x, y) = dimensions
             width = max(x, width)
         width += 2 * padding
 
@@ -216,6 +280,29 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
         blf.disable(FONT_ID, blf.WORD_WRAP)
         return
 
+    # Image editor areas on the current screen, refreshed when the screen
+    # changes or one of the areas disappears.
+    _image_editor_areas: List[bpy.types.Area] = []
+    _image_editor_screen: Optional[int] = None
+
+    def refresh_image_editor_areas(self, context: bpy.types.Context) -> None:
+        self._image_editor_areas = [
+            area for area in context.screen.areas if area.type == "IMAGE_EDITOR"
+        ]
+        self._image_editor_screen = context.screen.as_pointer()
+
+    def tag_redraw_image_editors(self, context: bpy.types.Context) -> None:
+        if self._image_editor_screen != context.screen.as_pointer():
+            self.refresh_image_editor_areas(context)
+        try:
+            for area in self._image_editor_areas:
+                area.tag_redraw()
+        except ReferenceError:
+            # The screen layout changed since we last looked
+            self.refresh_image_editor_areas(context)
+            for area in self._image_editor_areas:
+                area.tag_redraw()
+
     @staticmethod
     def cleanup_handle(context: bpy.types.Context) -> None:
         if RBR_OT_edit_material_maps.handle is not None:
@@ -231,21 +318,41 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
         RBR_OT_edit_material_maps.cleanup_handle(context)
 
     def modal(self, context: bpy.types.Context, event: bpy.types.Event) -> Set[str]:
-        # Force all image editors to redraw
-        # This makes sure the user defined boxes get drawn.
-        for area in context.screen.areas:
-            if area.type == "IMAGE_EDITOR":
-                area.tag_redraw()
-
+        result = self.refresh_blend_data(context)
+        if result is not None:
+            self.cleanup(context)
+            return result
         # Find the region the user is currently hovering over
         region_and_mouse = get_region_containing(context, event.mouse_x, event.mouse_y)
         if region_and_mouse is None:
+            self.tag_redraw_image_editors(context)
             return {"PASS_THROUGH"}
         (region, (rmx, rmy)) = region_and_mouse
 
         self._last_mouse_region = (region, rmx, rmy)
 
+        # Mouse moves which stay within the same cell and the same maps don't
+        # change anything on screen, so skip the redraw for them. Map edges
+        # can fall inside a cell, so the hovered maps are always found.
+        previous_hovered = self._hovered_map_indices
         self.set_hovered_map_indices(region, rmx, rmy)
+        (vx, vy) = region.view2d.region_to_view(rmx, rmy)
+        hovered_cell = self.mode.hovered_cell(self, vx, vy)
+        region_id = region.as_pointer()
+        unchanged = (
+            event.type == "MOUSEMOVE"
+            and hovered_cell is not None
+            and hovered_cell == self._last_hovered_pixel
+            and region_id == self._last_hovered_region_id
+            and self._hovered_map_indices == previous_hovered
+        )
+        self._last_hovered_pixel = hovered_cell
+        self._last_hovered_region_id = region_id
+
+        if not unchanged:
+            # Force all image editors to redraw
+            # This makes sure the user defined boxes get drawn.
+            self.tag_redraw_image_editors(context)
 
         # Defer to the mode handler
         result = self.mode.handle_event(self, event)
@@ -268,13 +375,12 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
         if node.node_tree.library is not None:
             self.report({"ERROR"}, "Node is from a library, edit the material there")
             return {"CANCELLED"}
-        if "IMAGE_EDITOR" not in [a.type for a in context.screen.areas]:
+        self.refresh_image_editor_areas(context)
+        if self._image_editor_areas == []:
             self.report({"ERROR"}, "Must have an image editor on screen")
             return {"CANCELLED"}
 
-        for area in context.screen.areas:
-            if area.type == "IMAGE_EDITOR":
-                area.tag_redraw()
+        self.tag_redraw_image_editors(context)
 
         self.to_overview_mode()
 
@@ -284,6 +390,7 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
             self.draw_editor_wrapped, (context,), "WINDOW", "POST_PIXEL"
         )
         self.update_active_texture(context)
+        self._blend_data_epoch = blend_data_epoch
         context.window_manager.modal_handler_add(self)
 
         RBR_OT_edit_material_maps.active_operator = self
@@ -294,7 +401,14 @@ class RBR_OT_edit_material_maps(Editor, bpy.types.Operator):
 
 def register() -> None:
     bpy.utils.register_class(RBR_OT_edit_material_maps)
+    for handlers in blend_data_epoch_handlers:
+        handlers.append(bump_blend_data_epoch)
 
 
 def unregister() -> None:
+    for handlers in blend_data_epoch_handlers:
+        try:
+            handlers.remove(bump_blend_data_epoch)
+        except ValueError:
+            pass
     bpy.utils.unregister_class(RBR_OT_edit_material_maps)
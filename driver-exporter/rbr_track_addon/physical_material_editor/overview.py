@@ -3,9 +3,14 @@ from typing import List, Set
 
 import bpy  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
 
 from .mode import Editor, Mode
-from .drawing_utils import draw_rect_view
+from .drawing_utils import (
+    draw_rect_region,
+    draw_rects_region,
+    material_maps_region_rects,
+)
 
 
 @dataclass
@@ -20,23 +25,32 @@ class OverviewMode(Mode):
         hovered = editor.hovered_map_indices()
         all_maps = editor.material_maps
         alpha = bpy.context.scene.rbr_material_picker.alpha
-        for i, mat in enumerate(all_maps):
-            opacity = alpha / 2
-            # Only highlight the last map: it'll be the last to be drawn, so
-            # it's always on top.
-            if hovered != [] and i == hovered[-1]:
-                opacity = alpha
-            draw_rect_view(
-                region,
-                Vector(mat.position_1),
-                Vector(mat.position_2),
-                bg_color=(1, 1, 1, opacity),
+        # Only highlight the last hovered map, and draw it separately so it's
+        # always on top. Everything else is drawn in one batch.
+        highlighted = hovered[-1] if hovered else None
+        rects = material_maps_region_rects(region, all_maps)
+        unhighlighted = np.ones(len(rects), dtype=bool)
+        if highlighted is not None and highlighted < len(rects):
+            unhighlighted[highlighted] = False
+        else:
+            highlighted = None
+        bg_colors = np.tile(
+            np.array([1, 1, 1, alpha / 2], dtype=np.float32),
+            (np.count_nonzero(unhighlighted), 1),
+        )
+        draw_rects_region(rects[unhighlighted], bg_colors)
+        if highlighted is not None:
+            (x0, y0, x1, y1) = rects[highlighted]
+            draw_rect_region(
+                Vector((x0, y0)),
+                Vector((x1, y1)),
+                bg_color=(1, 1, 1, alpha),
             )
 
     def handle_event(self, editor: Editor, event: bpy.types.Event) -> Set[str]:
         if event.type == "LEFTMOUSE" and event.value == "PRESS":
             hovered = editor.hovered_map_indices()
-            if hovered != []:
+            if hovered:
                 editor.to_resize_mode(resizing_index=hovered[-1])
             return {"RUNNING_MODAL"}
         elif event.type == "RIGHTMOUSE" and event.value == "PRESS":
@@ -1,10 +1,11 @@
-import math
-from typing import Any, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import bpy  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
 
 from rbr_track_formats import errors
+from rbr_track_formats.common import NumpyArray
 from rbr_track_formats.mat import (
     ConditionIdentifier,
     MaterialID,
@@ -19,14 +20,58 @@ def point_in_area(point: Vector, pos1: Vector, pos2: Vector) -> bool:
     (px, py) = point
     (x0, y0) = pos1
     (x1, y1) = pos2
-    return all(
-        [
-            px > min(x0, x1),
-            px < max(x0, x1),
-            py > min(y0, y1),
-            py < max(y0, y1),
-        ]
+    (lo_x, hi_x) = (x0, x1) if x0 < x1 else (x1, x0)
+    (lo_y, hi_y) = (y0, y1) if y0 < y1 else (y1, y0)
+    return lo_x < px < hi_x and lo_y < py < hi_y
+
+
+def point_in_sorted_area(
+    px: float, py: float, x0: float, y0: float, x1: float, y1: float
+) -> bool:
+    """Like point_in_area, for an area where x0 <= x1 and y0 <= y1"""
+    return x0 < px < x1 and y0 < py < y1
+
+
+def material_maps_bounds(material_maps: Any) -> NumpyArray:
+    """Get the corners of every map in a collection of RBRMaterialMaps, as a
+    (-1, 4) shape array of (x1, y1, x2, y2)"""
+    bounds = np.zeros(len(material_maps) * 4, dtype=float)
+    material_maps.foreach_get("bounds", bounds)
+    bounds = np.reshape(bounds, (-1, 4))
+    # Maps in linked libraries never get migrated, see legacy_bounds
+    for i, m in enumerate(material_maps):
+        legacy = legacy_bounds(m)
+        if legacy is not None:
+            bounds[i] = legacy
+    return bounds
+
+
+def legacy_bounds(material_maps: Any) -> Optional[Tuple[float, float, float, float]]:
+    """The corners of an RBRMaterialMaps saved before they were packed into
+    bounds, from the old position_1/position_2 properties, or None for maps
+    which don't have them. Local maps are migrated on load, but linked maps
+    (and local copies of them) keep the old properties."""
+    position_1 = material_maps.get("position_1")
+    position_2 = material_maps.get("position_2")
+    if position_1 is None and position_2 is None:
+        return None
+    (x1, y1) = position_1 if position_1 is not None else (0.0, 0.0)
+    (x2, y2) = position_2 if position_2 is not None else (0.0, 0.0)
+    return (x1, y1, x2, y2)
+
+
+def points_in_bounds(px: float, py: float, bounds: NumpyArray) -> NumpyArray:
+    """Test a point against many maps at once, given their sorted corners as
+    a (-1, 4) shape array (see material_maps_bounds). The maps are treated as
+    (center, half extent) boxes. Returns a bool array, one for each map."""
+    corners_1 = bounds[:, 0:2]
+    corners_2 = bounds[:, 2:4]
+    centers = (corners_1 + corners_2) / 2
+    half_extents = (corners_2 - corners_1) / 2
+    inside: NumpyArray = np.all(
+        np.abs(np.array((px, py)) - centers) < half_extents, axis=1
     )
+    return inside
 
 
 class RBRPropertyNodePointer(bpy.types.PropertyGroup):
@@ -40,19 +85,74 @@ class RBRPropertyNodePointer(bpy.types.PropertyGroup):
     nodetree_pointer: bpy.props.StringProperty()  # type: ignore
 
     def get_shader_node(self) -> Optional[bpy.types.ShaderNode]:
-        found_tree = None
         # Look for the node tree matching the pointer. Can't use name equality,
         # since node trees in different materials can have the same name!
-        # We can't actually use the pointer as a pointer, blender crashes. Not
-        # sure what the problem is, but this loop is fast enough.
-        for material in bpy.data.materials:
-            if material.use_nodes:
-                if str(material.node_tree.as_pointer()) == self.nodetree_pointer:
-                    found_tree = material.node_tree
-                    break
-        if found_tree is None:
+        # We can't actually use the pointer as a pointer, blender crashes, so
+        # we look up the material owning it in a cache instead.
+        node_tree = find_material_node_tree(self.nodetree_pointer)
+        if node_tree is None:
             return None
-        return found_tree.nodes.get(self.node_name)
+        return node_tree.nodes.get(self.node_name)
+
+
+# Materials keyed by the stringified pointer of their node tree, used by
+# RBRPropertyNodePointer. Materials are kept as (name, library filepath) keys,
+# since holding on to blender data can crash once it goes stale. Built lazily
+# and rebuilt when a lookup misses, which covers added, removed and renamed
+# materials. Thrown away on load/undo/redo, when the pointers change.
+node_tree_cache: Optional[Dict[str, Tuple[str, Optional[str]]]] = None
+
+
+def scan_material_node_trees() -> Dict[str, Tuple[str, Optional[str]]]:
+    return {
+        str(material.node_tree.as_pointer()): (
+            material.name,
+            None if material.library is None else material.library.filepath,
+        )
+        for material in bpy.data.materials
+        if material.use_nodes
+    }
+
+
+def resolve_material_node_tree(
+    key: Optional[Tuple[str, Optional[str]]], pointer: str
+) -> Optional[bpy.types.NodeTree]:
+    if key is None:
+        return None
+    material = bpy.data.materials.get(key)
+    # The material may have been removed, renamed or stopped using nodes
+    if material is None or not material.use_nodes:
+        return None
+    node_tree = material.node_tree
+    if str(node_tree.as_pointer()) != pointer:
+        return None
+    return node_tree
+
+
+def find_material_node_tree(pointer: str) -> Optional[bpy.types.NodeTree]:
+    global node_tree_cache
+    scanned = False
+    if node_tree_cache is None:
+        node_tree_cache = scan_material_node_trees()
+        scanned = True
+    node_tree = resolve_material_node_tree(node_tree_cache.get(pointer), pointer)
+    if node_tree is None and not scanned:
+        node_tree_cache = scan_material_node_trees()
+        node_tree = resolve_material_node_tree(node_tree_cache.get(pointer), pointer)
+    return node_tree
+
+
+@bpy.app.handlers.persistent  # type: ignore
+def invalidate_node_tree_cache(*args: Any) -> None:
+    global node_tree_cache
+    node_tree_cache = None
+
+
+node_tree_cache_handlers = [
+    bpy.app.handlers.load_post,
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+]
 
 
 class RBRMaterialID(bpy.types.PropertyGroup):
@@ -90,40 +190,51 @@ class RBRMaterialMap(bpy.types.PropertyGroup):
         """Set this blender property based material map from a plain material
         map
         """
-        self.rows.clear()
-        for mat_row in mat.bitmap:
-            row = self.rows.add()
-            for mat_id in mat_row:
-                col = row.cols.add()
-                col.material_id = mat_id.value
+        values = [[mat_id.value for mat_id in mat_row] for mat_row in mat.bitmap]
+        self.set_from_array(np.array(values, dtype=np.int32))
 
     def to_format(self) -> MaterialMap:
         """Convert this blender property based material map into a plain
         material map
         """
-        rows: List[List[MaterialID]] = []
-        for mat_row in self.rows:
-            cols = []
-            for mat_id in mat_row.cols:
-                cols.append(mat_id.to_material())
-            rows.append(cols)
+        rows: List[List[MaterialID]] = [
+            [MaterialID(mat_id) for mat_id in mat_row]
+            for mat_row in self.to_array().tolist()
+        ]
         return MaterialMap(bitmap=rows)
 
+    def set_from_array(self, values: NumpyArray) -> None:
+        """Set material ids from a (16, 16) shape integer array"""
+        # Maps are always 16x16, so reuse the existing rows and columns if
+        # they're there: adding collection items is slow.
+        if len(self.rows) != 16 or any(len(row.cols) != 16 for row in self.rows):
+            self.rows.clear()
+            self.__init__()
+        for row, row_values in zip(self.rows, values):
+            row.cols.foreach_set("material_id", row_values.astype(np.int32))
+
+    def to_array(self) -> NumpyArray:
+        """Get material ids as a (16, 16) shape int32 array. The ids are
+        IntProperties, so they are read as is rather than wrapped into a
+        smaller type."""
+        values = np.empty((len(self.rows), 16), dtype=np.int32)
+        for row, row_values in zip(self.rows, values):
+            row.cols.foreach_get("material_id", row_values)
+        return values
+
 
 class RBRMaterialMaps(bpy.types.PropertyGroup):
     """A collection of material maps, one for each surface type/wear
     combination. This also controls the corner positions of all maps.
     """
 
-    # Position of one corner in UV coordinates
-    # This is the bottom left of the viewport
-    position_1: bpy.props.FloatVectorProperty(size=2)  # type: ignore
-    # Position of opposite corner in UV coordinates
-    # This is the top right of the viewport
+    # Corner positions in UV coordinates, packed as (x1, y1, x2, y2) so they
+    # can be read in one go. position_1 is the bottom left of the viewport,
+    # position_2 is the opposite corner at the top right of the viewport.
     # Invariant: both X and Y coordinates are higher than X and Y coordinates of
     # position_1. This way the maps are always the same way up, and copying and
     # pasting between them works properly.
-    position_2: bpy.props.FloatVectorProperty(size=2)  # type: ignore
+    bounds: bpy.props.FloatVectorProperty(size=4)  # type: ignore
     maps: bpy.props.CollectionProperty(  # type: ignore
         type=RBRMaterialMap,
     )
@@ -137,39 +248,80 @@ class RBRMaterialMaps(bpy.types.PropertyGroup):
             m.__init__()
         self.maintain_position_invariant()
 
+    def get_bounds(self) -> Tuple[float, float, float, float]:
+        """The corners as (x1, y1, x2, y2). Use this rather than reading
+        bounds directly, so maps which haven't been migrated still work."""
+        legacy = legacy_bounds(self)
+        if legacy is not None:
+            return legacy
+        (x1, y1, x2, y2) = self.bounds
+        return (x1, y1, x2, y2)
+
+    def set_bounds(self, bounds: Tuple[float, float, float, float]) -> None:
+        """Set the corners, dropping the old properties which would otherwise
+        take precedence"""
+        self.bounds = bounds
+        for key in ["position_1", "position_2"]:
+            if key in self:
+                del self[key]
+
+    @property
+    def position_1(self) -> Vector:
+        return Vector(self.get_bounds()[0:2])
+
+    @position_1.setter
+    def position_1(self, value: Vector) -> None:
+        (_, _, x2, y2) = self.get_bounds()
+        self.set_bounds((value[0], value[1], x2, y2))
+
+    @property
+    def position_2(self) -> Vector:
+        return Vector(self.get_bounds()[2:4])
+
+    @position_2.setter
+    def position_2(self, value: Vector) -> None:
+        (x1, y1, _, _) = self.get_bounds()
+        self.set_bounds((x1, y1, value[0], value[1]))
+
     # 'other' has type RBRMaterialMaps, but we can't specify that here without
     # from __future__ import annotations, and that breaks PropertyGroup
     # definitions. See CONTRIBUTING.md.
     def copy(self, other: Any) -> None:
-        self.position_1 = other.position_1
-        self.position_2 = other.position_2
+        self.set_bounds(other.get_bounds())
         self.repeat_x = other.repeat_x
         self.repeat_y = other.repeat_y
-        self.maps.clear()
-        for other_map in other.maps:
-            map = self.maps.add()
-            map.set_from_format(other_map.to_format())
+        self.copy_maps(other)
+
+    def copy_maps(self, other: Any) -> None:
+        """Copy only the material maps of other, not the corners or repeat
+        flags"""
+        if len(self.maps) != len(other.maps):
+            self.maps.clear()
+            for _ in other.maps:
+                self.maps.add()
+        for map, other_map in zip(self.maps, other.maps):
+            map.set_from_array(other_map.to_array())
 
     def maintain_position_invariant(self) -> Tuple[bool, bool]:
         """Maintain the position invariant (see comment by position
         definitions)"""
-        (p1x, p1y) = self.position_1
-        (p2x, p2y) = self.position_2
-        flip_x = p1x > p2x
-        flip_y = p1y > p2y
-        if flip_x:
-            self.position_1[0] = p2x
-            self.position_2[0] = p1x
-        if flip_y:
-            self.position_1[1] = p2y
-            self.position_2[1] = p1y
-        # Fix positions if this map is marked as repeated
+        (p1x, p1y, p2x, p2y) = self.get_bounds()
+        # Repeated maps have fixed positions in that axis, so never flip.
         if self.repeat_x:
-            self.position_1[0] = 0.0
-            self.position_2[0] = 1.0
+            (p1x, p2x) = (0.0, 1.0)
+            flip_x = False
+        else:
+            flip_x = p1x > p2x
+            if flip_x:
+                (p1x, p2x) = (p2x, p1x)
         if self.repeat_y:
-            self.position_1[1] = 0.0
-            self.position_2[1] = 1.0
+            (p1y, p2y) = (0.0, 1.0)
+            flip_y = False
+        else:
+            flip_y = p1y > p2y
+            if flip_y:
+                (p1y, p2y) = (p2y, p1y)
+        self.set_bounds((p1x, p1y, p2x, p2y))
         return (flip_x, flip_y)
 
     def update_mat_pos(
@@ -178,34 +330,31 @@ class RBRMaterialMaps(bpy.types.PropertyGroup):
         """Update the material position using a grab handle, and possibly return
         a new grab handle. The returned grab handle is present when the map gets
         flipped in an axis, to make sure maps are always the same way up."""
+        (p1x, p1y, p2x, p2y) = self.get_bounds()
         if handle == GrabHandle.BOTTOM_LEFT:
-            self.position_1[0] = mouse_pos.x
-            self.position_1[1] = mouse_pos.y
+            (p1x, p1y) = (mouse_pos.x, mouse_pos.y)
         elif handle == GrabHandle.BOTTOM_MID:
-            self.position_1[1] = mouse_pos.y
+            p1y = mouse_pos.y
         elif handle == GrabHandle.BOTTOM_RIGHT:
-            self.position_2[0] = mouse_pos.x
-            self.position_1[1] = mouse_pos.y
+            (p2x, p1y) = (mouse_pos.x, mouse_pos.y)
         elif handle == GrabHandle.MID_LEFT:
-            self.position_1[0] = mouse_pos.x
+            p1x = mouse_pos.x
         elif handle == GrabHandle.MID_RIGHT:
-            self.position_2[0] = mouse_pos.x
+            p2x = mouse_pos.x
         elif handle == GrabHandle.TOP_LEFT:
-            self.position_1[0] = mouse_pos.x
-            self.position_2[1] = mouse_pos.y
+            (p1x, p2y) = (mouse_pos.x, mouse_pos.y)
         elif handle == GrabHandle.TOP_MID:
-            self.position_2[1] = mouse_pos.y
+            p2y = mouse_pos.y
         elif handle == GrabHandle.TOP_RIGHT:
-            self.position_2[0] = mouse_pos.x
-            self.position_2[1] = mouse_pos.y
+            (p2x, p2y) = (mouse_pos.x, mouse_pos.y)
+        self.set_bounds((p1x, p1y, p2x, p2y))
         (flip_x, flip_y) = self.maintain_position_invariant()
         return handle.flip(flip_x, flip_y)
 
     def drag(self, delta: Vector) -> None:
-        self.position_1[0] += delta.x
-        self.position_1[1] += delta.y
-        self.position_2[0] += delta.x
-        self.position_2[1] += delta.y
+        (p1x, p1y, p2x, p2y) = self.get_bounds()
+        (dx, dy) = (delta.x, delta.y)
+        self.set_bounds((p1x + dx, p1y + dy, p2x + dx, p2y + dy))
         self.maintain_position_invariant()
 
     def get_map(
@@ -229,19 +378,18 @@ class RBRMaterialMaps(bpy.types.PropertyGroup):
     def uv_to_mat(self, pos: Vector) -> Vector:
         """From UV space (view space) to material space"""
         (x, y) = pos.to_tuple()
-        (x0, y0) = self.position_1
-        (x1, y1) = self.position_2
+        return Vector(self.uv_to_mat_floats(x, y))
+
+    def uv_to_mat_floats(self, x: float, y: float) -> Tuple[float, float]:
+        """From UV space (view space) to material space, without going through
+        Vector"""
+        (x0, y0, x1, y1) = self.get_bounds()
         dx = x1 - x0
         dy = y1 - y0
-        if dx != 0:
-            mat_x = (x - x0) / dx
-        else:
-            mat_x = 0
-        if dy != 0:
-            mat_y = (y - y0) / dy
-        else:
-            mat_y = 0
-        return Vector((mat_x, mat_y))
+        # Degenerate maps are rare, map everything to zero for those.
+        inv_dx = 0.0 if dx == 0 else 1.0 / dx
+        inv_dy = 0.0 if dy == 0 else 1.0 / dy
+        return ((x - x0) * inv_dx, (y - y0) * inv_dy)
 
     def quantized_uv(self, uv_x: float, uv_y: float) -> Tuple[int, int]:
         """Given UV coordinates in texture UV space, return the RBR collision
@@ -251,25 +399,57 @@ class RBRMaterialMaps(bpy.types.PropertyGroup):
         of the leftmost pixel, and the right side of the rightmost pixel, and if
         this was treated the same way as the pixel calculation, we'd need 17
         distinct points)."""
-        mat = self.uv_to_mat(Vector((uv_x, uv_y)))
-
-        def clamp(a: int) -> int:
-            return max(0, min(15, round(a * 15)))
-
-        return (clamp(mat.y), clamp(mat.x))
+        (mat_x, mat_y) = self.uv_to_mat_floats(uv_x, uv_y)
+        # round() rounds halves to even, as the quantization always has, so
+        # existing tracks export the same collision materials.
+        qx = round(mat_x * 15.0)
+        qy = round(mat_y * 15.0)
+        return (
+            0 if qy < 0 else 15 if qy > 15 else qy,
+            0 if qx < 0 else 15 if qx > 15 else qx,
+        )
 
     def pixel(self, uv_x: float, uv_y: float) -> Tuple[int, int]:
         """Find the x,y coordinates of the pixel containing the given UV
         coordinates"""
-        mat = self.uv_to_mat(Vector((uv_x, uv_y)))
-
-        def clamp(a: int) -> int:
-            return max(0, min(15, math.floor(a * 16)))
-
-        return (clamp(mat.x), clamp(mat.y))
+        (mat_x, mat_y) = self.uv_to_mat_floats(uv_x, uv_y)
+        # int truncates towards zero rather than flooring, but negative values
+        # are clamped to zero anyway.
+        px = int(mat_x * 16.0)
+        py = int(mat_y * 16.0)
+        return (
+            0 if px < 0 else 15 if px > 15 else px,
+            0 if py < 0 else 15 if py > 15 else py,
+        )
 
     def point_in_map(self, px: int, py: int) -> bool:
-        return point_in_area(Vector((px, py)), self.position_1, self.position_2)
+        # The position invariant means the corners are already sorted.
+        (x0, y0, x1, y1) = self.get_bounds()
+        return point_in_sorted_area(px, py, x0, y0, x1, y1)
+
+
+def extend_material_maps(target: Any, source: Any) -> None:
+    """Append copies of every RBRMaterialMaps in the source collection to the
+    target collection. The corners and repeat flags of all of them are copied
+    in one go."""
+    start = len(target)
+    for _ in source:
+        target.add()
+    bounds = np.zeros(len(target) * 4, dtype=float)
+    target.foreach_get("bounds", bounds)
+    # Not foreach_get, the source may hold maps which haven't been migrated
+    bounds[start * 4 :] = material_maps_bounds(source).ravel()
+    target.foreach_set("bounds", bounds)
+    for prop, size, dtype in [
+        ("repeat_x", 1, bool),
+        ("repeat_y", 1, bool),
+    ]:
+        values = np.zeros(len(target) * size, dtype=dtype)
+        target.foreach_get(prop, values)
+        source.foreach_get(prop, values[start * size :])
+        target.foreach_set(prop, values)
+    for new, original in zip(target[start:], source):
+        new.copy_maps(original)
 
 
 class RBRFallbackMaterials(bpy.types.PropertyGroup):
@@ -292,52 +472,68 @@ class RBRFallbackMaterials(bpy.types.PropertyGroup):
     def get_condition(
         self, surface_type: SurfaceType, surface_age: SurfaceAge
     ) -> MaterialID:
-        if surface_type is SurfaceType.DRY and surface_age is SurfaceAge.NEW:
-            return self.dry_new.to_material()  # type: ignore
-        elif surface_type is SurfaceType.DRY and surface_age is SurfaceAge.NORMAL:
-            return self.dry_normal.to_material()  # type: ignore
-        elif surface_type is SurfaceType.DRY and surface_age is SurfaceAge.WORN:
-            return self.dry_worn.to_material()  # type: ignore
-        elif surface_type is SurfaceType.DAMP and surface_age is SurfaceAge.NEW:
-            return self.damp_new.to_material()  # type: ignore
-        elif surface_type is SurfaceType.DAMP and surface_age is SurfaceAge.NORMAL:
-            return self.damp_normal.to_material()  # type: ignore
-        elif surface_type is SurfaceType.DAMP and surface_age is SurfaceAge.WORN:
-            return self.damp_worn.to_material()  # type: ignore
-        elif surface_type is SurfaceType.WET and surface_age is SurfaceAge.NEW:
-            return self.wet_new.to_material()  # type: ignore
-        elif surface_type is SurfaceType.WET and surface_age is SurfaceAge.NORMAL:
-            return self.wet_normal.to_material()  # type: ignore
-        elif surface_type is SurfaceType.WET and surface_age is SurfaceAge.WORN:
-            return self.wet_worn.to_material()  # type: ignore
-        else:
-            raise errors.RBRAddonBug(
-                f"Unhandled type/age in active_material: {surface_type} {surface_age}"
-            )
+        return self.condition_property(surface_type, surface_age).to_material()
 
     def set_from_active(self) -> None:
         paint_material = bpy.context.scene.rbr_material_picker.material_id
         track_settings = bpy.context.scene.rbr_track_settings
         surface_type: SurfaceType = track_settings.get_active_surface_type()
         surface_age: SurfaceAge = track_settings.get_active_surface_age()
-        if surface_type is SurfaceType.DRY and surface_age is SurfaceAge.NEW:
-            self.dry_new.material_id = paint_material
-        elif surface_type is SurfaceType.DRY and surface_age is SurfaceAge.NORMAL:
-            self.dry_normal.material_id = paint_material
-        elif surface_type is SurfaceType.DRY and surface_age is SurfaceAge.WORN:
-            self.dry_worn.material_id = paint_material
-        elif surface_type is SurfaceType.DAMP and surface_age is SurfaceAge.NEW:
-            self.damp_new.material_id = paint_material
-        elif surface_type is SurfaceType.DAMP and surface_age is SurfaceAge.NORMAL:
-            self.damp_normal.material_id = paint_material
-        elif surface_type is SurfaceType.DAMP and surface_age is SurfaceAge.WORN:
-            self.damp_worn.material_id = paint_material
-        elif surface_type is SurfaceType.WET and surface_age is SurfaceAge.NEW:
-            self.wet_new.material_id = paint_material
-        elif surface_type is SurfaceType.WET and surface_age is SurfaceAge.NORMAL:
-            self.wet_normal.material_id = paint_material
-        elif surface_type is SurfaceType.WET and surface_age is SurfaceAge.WORN:
-            self.wet_worn.material_id = paint_material
+        self.condition_property(surface_type, surface_age).material_id = paint_material
+
+    def condition_property(
+        self, surface_type: SurfaceType, surface_age: SurfaceAge
+    ) -> RBRMaterialID:
+        try:
+            attr = FALLBACK_MATERIAL_ATTRS[(surface_type, surface_age)]
+        except KeyError:
+            raise errors.RBRAddonBug(
+                f"Unhandled type/age in active_material: {surface_type} {surface_age}"
+            )
+        return getattr(self, attr)
+
+
+def migrate_material_maps_bounds(material_maps: Any) -> None:
+    """Copy the old position_1/position_2 corner properties of a collection
+    of RBRMaterialMaps into bounds"""
+    for m in material_maps:
+        legacy = legacy_bounds(m)
+        if legacy is None:
+            continue
+        m.set_bounds(legacy)
+
+
+def migrate_all_material_maps_bounds() -> None:
+    """Material map corners used to be stored as two separate properties.
+    Linked data can't be written, so it is left alone."""
+    for node_tree in bpy.data.node_groups:
+        if node_tree.library is not None:
+            continue
+        internal = node_tree.nodes.get("internal")
+        material_maps = getattr(internal, "material_maps", None)
+        if material_maps is not None:
+            migrate_material_maps_bounds(material_maps)
+    for scene in bpy.data.scenes:
+        if scene.library is not None:
+            continue
+        rbr_textures = getattr(scene, "rbr_textures", None)
+        if rbr_textures is not None:
+            for rbr_texture in rbr_textures.textures:
+                migrate_material_maps_bounds(rbr_texture.material_maps)
+
+
+# Which RBRFallbackMaterials property holds each surface condition
+FALLBACK_MATERIAL_ATTRS: Dict[Tuple[SurfaceType, SurfaceAge], str] = {
+    (SurfaceType.DRY, SurfaceAge.NEW): "dry_new",
+    (SurfaceType.DRY, SurfaceAge.NORMAL): "dry_normal",
+    (SurfaceType.DRY, SurfaceAge.WORN): "dry_worn",
+    (SurfaceType.DAMP, SurfaceAge.NEW): "damp_new",
+    (SurfaceType.DAMP, SurfaceAge.NORMAL): "damp_normal",
+    (SurfaceType.DAMP, SurfaceAge.WORN): "damp_worn",
+    (SurfaceType.WET, SurfaceAge.NEW): "wet_new",
+    (SurfaceType.WET, SurfaceAge.NORMAL): "wet_normal",
+    (SurfaceType.WET, SurfaceAge.WORN): "wet_worn",
+}
 
 
 def register() -> None:
@@ -347,9 +543,16 @@ def register() -> None:
     bpy.utils.register_class(RBRMaterialMap)
     bpy.utils.register_class(RBRMaterialMaps)
     bpy.utils.register_class(RBRFallbackMaterials)
+    for handlers in node_tree_cache_handlers:
+        handlers.append(invalidate_node_tree_cache)
 
 
 def unregister() -> None:
+    for handlers in node_tree_cache_handlers:
+        try:
+            handlers.remove(invalidate_node_tree_cache)
+        except ValueError:
+            pass
     bpy.utils.unregister_class(RBRFallbackMaterials)
     bpy.utils.unregister_class(RBRMaterialMaps)
     bpy.utils.unregister_class(RBRMaterialMap)
@@ -1,16 +1,22 @@
-from dataclasses import dataclass
-from typing import List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import bpy  # type: ignore
 from mathutils import Vector  # type: ignore
+import numpy as np
 
 from .mode import Editor, Mode
 from .properties import point_in_area
-from .types import GrabHandle
-from .drawing_utils import draw_rect_region, draw_rect_view
+from .types import GrabHandle, POSITION_RELATIVE
+from .drawing_utils import (
+    draw_rect_region,
+    draw_rects_region,
+    material_maps_region_rects,
+    view_to_region_transform,
+)
 
 
-@dataclass
+@dataclass(slots=True)
 class ResizeMode(Mode):
     resizing_index: int
     grab_handle: Optional[GrabHandle] = None
@@ -18,6 +24,12 @@ class ResizeMode(Mode):
     # Start position and last position of drag, in view space
     drag_start_pos: Optional[Vector] = None
     drag_last_pos: Optional[Vector] = None
+    # Grab handle positions from the last draw, keyed by region pointer, along
+    # with the (view transform, map bounds) they were computed for. Panning or
+    # zooming moves the handles without a redraw before the next click.
+    _handle_region_positions: Dict[
+        int, Tuple[Tuple[Any, ...], List[Tuple[GrabHandle, Vector]]]
+    ] = field(default_factory=dict)
 
     def draw(
         self,
@@ -25,37 +37,41 @@ class ResizeMode(Mode):
         region: bpy.types.Region,
     ) -> None:
         all_maps = editor.material_maps
-        resizing_mat = None
         alpha = bpy.context.scene.rbr_material_picker.alpha
-        for i, mat in enumerate(all_maps):
-            # Draw the resizing one on top of others
-            if i == self.resizing_index:
-                resizing_mat = mat
-                continue
-            draw_rect_view(
-                region,
-                Vector(mat.position_1),
-                Vector(mat.position_2),
-                bg_color=(1, 1, 1, alpha / 2),
-            )
+        # Draw every other map in one batch, and the resizing one separately
+        # so it's always on top.
+        rects = material_maps_region_rects(region, all_maps)
+        others = np.ones(len(rects), dtype=bool)
+        resizing_mat = None
+        if self.resizing_index < len(rects):
+            others[self.resizing_index] = False
+            resizing_mat = all_maps[self.resizing_index]
+        bg_colors = np.tile(
+            np.array([1, 1, 1, alpha / 2], dtype=np.float32),
+            (np.count_nonzero(others), 1),
+        )
+        draw_rects_region(rects[others], bg_colors)
         if resizing_mat is not None:
-            draw_rect_view(
-                region,
-                Vector(resizing_mat.position_1),
-                Vector(resizing_mat.position_2),
+            (x0, y0, x1, y1) = rects[self.resizing_index]
+            draw_rect_region(
+                Vector((x0, y0)),
+                Vector((x1, y1)),
                 bg_color=(1, 1, 1, alpha),
             )
-            for handle in GrabHandle:
-                grabbable = handle.is_grabbable(
-                    repeat_x=resizing_mat.repeat_x,
-                    repeat_y=resizing_mat.repeat_y,
-                )
+            repeat_x = resizing_mat.repeat_x
+            repeat_y = resizing_mat.repeat_y
+            handle_positions = self.handle_region_positions(resizing_mat, region)
+            # Keep these around for hit testing grab handles on mouse press
+            self._handle_region_positions[region.as_pointer()] = (
+                self.handle_positions_key(resizing_mat, region),
+                handle_positions,
+            )
+            for handle, p in handle_positions:
+                grabbable = handle.is_grabbable(repeat_x=repeat_x, repeat_y=repeat_y)
                 if grabbable:
                     bg_color = (1.0, 1.0, 1.0, 1.0)
                 else:
                     bg_color = (0.4, 0.4, 0.4, 1.0)
-                (x, y) = self.grab_handle_pos(editor, handle)
-                p = Vector(region.view2d.view_to_region(x, y, clip=False))
                 draw_rect_region(
                     p - self.grab_handle_size,
                     p + self.grab_handle_size,
@@ -63,18 +79,27 @@ class ResizeMode(Mode):
                     border_color=(0, 0, 0, 1),
                 )
 
-    def grab_handle_pos(
-        self, editor: Editor, handle: GrabHandle
-    ) -> Tuple[float, float]:
-        if self.resizing_index >= len(editor.material_maps):
-            return (0, 0)
-        mat = editor.material_maps[self.resizing_index]
-        (x0, y0) = mat.position_1
-        (x1, y1) = mat.position_2
+    def handle_positions_key(
+        self, mat: Any, region: bpy.types.Region
+    ) -> Tuple[Any, ...]:
+        """What the grab handle positions of the given map (RBRMaterialMaps) in
+        the given region depend on"""
+        (offset, scale) = view_to_region_transform(region)
+        return (tuple(offset), tuple(scale), mat.get_bounds())
+
+    def handle_region_positions(
+        self, mat: Any, region: bpy.types.Region
+    ) -> List[Tuple[GrabHandle, Vector]]:
+        """Positions of all grab handles of the given map (RBRMaterialMaps) in
+        region space"""
+        (x0, y0, x1, y1) = mat.get_bounds()
         dx = x1 - x0
         dy = y1 - y0
-        (mx, my) = handle.position_relative().to_tuple()
-        return (x0 + dx * mx, y0 + dy * my)
+        view_to_region = region.view2d.view_to_region
+        return [
+            (handle, Vector(view_to_region(x0 + dx * mx, y0 + dy * my, clip=False)))
+            for (handle, (mx, my)) in POSITION_RELATIVE.items()
+        ]
 
     def handle_event(self, editor: Editor, event: bpy.types.Event) -> Set[str]:
         (region, mx, my) = editor.last_mouse_region()
@@ -98,9 +123,14 @@ class ResizeMode(Mode):
             self.grab_handle = None
             # Deal with grab handles first, exiting the handler early if we are
             # grabbing one.
-            for handle in GrabHandle:
-                (x, y) = self.grab_handle_pos(editor, handle)
-                p = Vector(region.view2d.view_to_region(x, y, clip=False))
+            cached = self._handle_region_positions.get(region.as_pointer())
+            if cached is not None and cached[0] == self.handle_positions_key(
+                mat, region
+            ):
+                handle_positions = cached[1]
+            else:
+                handle_positions = self.handle_region_positions(mat, region)
+            for handle, p in handle_positions:
                 grabbing = point_in_area(
                     Vector((mx, my)),
                     p - self.grab_handle_size,
@@ -115,7 +145,7 @@ class ResizeMode(Mode):
                 self.drag_start_pos = cursor_pos_view
                 self.drag_last_pos = cursor_pos_view
             # If the cursor is hovering nothing, go back to overview
-            elif hovered == []:
+            elif not hovered:
                 editor.to_overview_mode()
             # Or switch directly to the topmost hovered map
             else:
@@ -133,22 +163,21 @@ class ResizeMode(Mode):
             # as a simple mouse press and cycle through the available maps.
             if self.drag_start_pos is not None:
                 (dx, dy) = self.drag_start_pos
-                drag_pixel_start = Vector(
-                    region.view2d.view_to_region(dx, dy, clip=False)
-                )
-                drag_vector_pixels = Vector((mx, my)) - drag_pixel_start
-                if drag_vector_pixels.length < 2:
+                (sx, sy) = region.view2d.view_to_region(dx, dy, clip=False)
+                # Compare squared lengths, a 2 pixel drag is 4 squared pixels
+                if (mx - sx) ** 2 + (my - sy) ** 2 < 4:
                     hovered = editor.hovered_map_indices()
+                    # Use the map after the currently resized one. If it's the
+                    # last one, or the new hovered set doesn't contain the
+                    # currently resized map, we can just use the zeroeth map.
                     index_to_use = 0
-                    try:
-                        i = hovered.index(self.resizing_index)
-                        if i + 1 < len(hovered):
-                            index_to_use = i + 1
-                    except ValueError:
-                        # New hovered set doesn't contain the currently resized map.
-                        # We can just use the zeroeth map.
-                        pass
-                    editor.to_resize_mode(hovered[index_to_use])
+                    for i, map_index in enumerate(hovered):
+                        if map_index == self.resizing_index:
+                            if i + 1 < len(hovered):
+                                index_to_use = i + 1
+                            break
+                    if hovered:
+                        editor.to_resize_mode(hovered[index_to_use])
                 self.drag_start_pos = None
             return {"RUNNING_MODAL"}
         elif (
@@ -156,6 +185,7 @@ class ResizeMode(Mode):
         ) and event.value == "PRESS":
             all_maps = editor.material_maps
             all_maps.remove(self.resizing_index)
+            editor.material_maps_changed()
             editor.to_overview_mode()
             return {"RUNNING_MODAL"}
         elif event.type == "X":
@@ -1,9 +1,7 @@
 from __future__ import annotations
 
 import enum
-from typing import Optional
-
-from mathutils import Vector  # type: ignore
+from typing import Dict, Optional, Tuple
 
 
 # This used to live in properties, but I had to move it here because of
@@ -18,80 +16,21 @@ class GrabHandle(enum.Enum):
     BOTTOM_MID = 7
     BOTTOM_RIGHT = 8
 
-    def position_relative(self) -> Vector:
-        if self is GrabHandle.TOP_LEFT:
-            return Vector((0, 1))
-        elif self is GrabHandle.TOP_MID:
-            return Vector((0.5, 1))
-        elif self is GrabHandle.TOP_RIGHT:
-            return Vector((1, 1))
-        elif self is GrabHandle.MID_LEFT:
-            return Vector((0, 0.5))
-        elif self is GrabHandle.MID_RIGHT:
-            return Vector((1, 0.5))
-        elif self is GrabHandle.BOTTOM_LEFT:
-            return Vector((0, 0))
-        elif self is GrabHandle.BOTTOM_MID:
-            return Vector((0.5, 0))
-        elif self is GrabHandle.BOTTOM_RIGHT:
-            return Vector((1, 0))
+    def position_relative(self) -> Tuple[float, float]:
+        return POSITION_RELATIVE[self]
 
     def is_grabbable(self, repeat_x: bool, repeat_y: bool) -> bool:
         """Only handles which do not lie on a repeated edge are grabbable."""
-        if self is GrabHandle.TOP_LEFT:
-            return not repeat_x and not repeat_y
-        elif self is GrabHandle.TOP_MID:
-            return not repeat_y
-        elif self is GrabHandle.TOP_RIGHT:
-            return not repeat_x and not repeat_y
-        elif self is GrabHandle.MID_LEFT:
-            return not repeat_x
-        elif self is GrabHandle.MID_RIGHT:
-            return not repeat_x
-        elif self is GrabHandle.BOTTOM_LEFT:
-            return not repeat_x and not repeat_y
-        elif self is GrabHandle.BOTTOM_MID:
-            return not repeat_y
-        elif self is GrabHandle.BOTTOM_RIGHT:
-            return not repeat_x and not repeat_y
+        (on_x_edge, on_y_edge) = ON_EDGE[self]
+        return not (repeat_x and on_x_edge) and not (repeat_y and on_y_edge)
 
     def flip_x(self) -> GrabHandle:
         """Flip a grab handle in the X axis (left becomes right)"""
-        if self is GrabHandle.TOP_LEFT:
-            return GrabHandle.TOP_RIGHT
-        elif self is GrabHandle.TOP_MID:
-            return GrabHandle.TOP_MID
-        elif self is GrabHandle.TOP_RIGHT:
-            return GrabHandle.TOP_LEFT
-        elif self is GrabHandle.MID_LEFT:
-            return GrabHandle.MID_RIGHT
-        elif self is GrabHandle.MID_RIGHT:
-            return GrabHandle.MID_LEFT
-        elif self is GrabHandle.BOTTOM_LEFT:
-            return GrabHandle.BOTTOM_RIGHT
-        elif self is GrabHandle.BOTTOM_MID:
-            return GrabHandle.BOTTOM_MID
-        elif self is GrabHandle.BOTTOM_RIGHT:
-            return GrabHandle.BOTTOM_LEFT
+        return FLIP_X[self]
 
     def flip_y(self) -> GrabHandle:
         """Flip a grab handle in the Y axis (top becomes bottom)"""
-        if self is GrabHandle.TOP_LEFT:
-            return GrabHandle.BOTTOM_LEFT
-        elif self is GrabHandle.TOP_MID:
-            return GrabHandle.BOTTOM_MID
-        elif self is GrabHandle.TOP_RIGHT:
-            return GrabHandle.BOTTOM_RIGHT
-        elif self is GrabHandle.MID_LEFT:
-            return GrabHandle.MID_LEFT
-        elif self is GrabHandle.MID_RIGHT:
-            return GrabHandle.MID_RIGHT
-        elif self is GrabHandle.BOTTOM_LEFT:
-            return GrabHandle.TOP_LEFT
-        elif self is GrabHandle.BOTTOM_MID:
-            return GrabHandle.TOP_MID
-        elif self is GrabHandle.BOTTOM_RIGHT:
-            return GrabHandle.TOP_RIGHT
+        return FLIP_Y[self]
 
     def flip(self, x: bool, y: bool) -> Optional[GrabHandle]:
         """Flip a grab handle along x and y axes, returns None if the grab
@@ -105,3 +44,51 @@ class GrabHandle(enum.Enum):
             return None
         else:
             return handle
+
+
+# Position of each handle relative to the bottom left of the map, in units of
+# the map size.
+POSITION_RELATIVE: Dict[GrabHandle, Tuple[float, float]] = {
+    GrabHandle.TOP_LEFT: (0, 1),
+    GrabHandle.TOP_MID: (0.5, 1),
+    GrabHandle.TOP_RIGHT: (1, 1),
+    GrabHandle.MID_LEFT: (0, 0.5),
+    GrabHandle.MID_RIGHT: (1, 0.5),
+    GrabHandle.BOTTOM_LEFT: (0, 0),
+    GrabHandle.BOTTOM_MID: (0.5, 0),
+    GrabHandle.BOTTOM_RIGHT: (1, 0),
+}
+
+# Whether each handle moves the left/right edges (x) and top/bottom edges (y).
+ON_EDGE: Dict[GrabHandle, Tuple[bool, bool]] = {
+    GrabHandle.TOP_LEFT: (True, True),
+    GrabHandle.TOP_MID: (False, True),
+    GrabHandle.TOP_RIGHT: (True, True),
+    GrabHandle.MID_LEFT: (True, False),
+    GrabHandle.MID_RIGHT: (True, False),
+    GrabHandle.BOTTOM_LEFT: (True, True),
+    GrabHandle.BOTTOM_MID: (False, True),
+    GrabHandle.BOTTOM_RIGHT: (True, True),
+}
+
+FLIP_X: Dict[GrabHandle, GrabHandle] = {
+    GrabHandle.TOP_LEFT: GrabHandle.TOP_RIGHT,
+    GrabHandle.TOP_MID: GrabHandle.TOP_MID,
+    GrabHandle.TOP_RIGHT: GrabHandle.TOP_LEFT,
+    GrabHandle.MID_LEFT: GrabHandle.MID_RIGHT,
+    GrabHandle.MID_RIGHT: GrabHandle.MID_LEFT,
+    GrabHandle.BOTTOM_LEFT: GrabHandle.BOTTOM_RIGHT,
+    GrabHandle.BOTTOM_MID: GrabHandle.BOTTOM_MID,
+    GrabHandle.BOTTOM_RIGHT: GrabHandle.BOTTOM_LEFT,
+}
+
+FLIP_Y: Dict[GrabHandle, GrabHandle] = {
+    GrabHandle.TOP_LEFT: GrabHandle.BOTTOM_LEFT,
+    GrabHandle.TOP_MID: GrabHandle.BOTTOM_MID,
+    GrabHandle.TOP_RIGHT: GrabHandle.BOTTOM_RIGHT,
+    GrabHandle.MID_LEFT: GrabHandle.MID_LEFT,
+    GrabHandle.MID_RIGHT: GrabHandle.MID_RIGHT,
+    GrabHandle.BOTTOM_LEFT: GrabHandle.TOP_LEFT,
+    GrabHandle.BOTTOM_MID: GrabHandle.TOP_MID,
+    GrabHandle.BOTTOM_RIGHT: GrabHandle.TOP_RIGHT,
+}
@@ -1,5 +1,5 @@
 import enum
-from typing import Optional, Set, Tuple
+from typing import Any, Dict, Optional, Set, Tuple
 
 import bpy  # type: ignore
 
@@ -11,30 +11,63 @@ class DistStyle(enum.Enum):
     RSF = 1
 
     def pretty(self) -> str:
-        if self is DistStyle.ORIGINAL:
-            return "Original"
-        elif self is DistStyle.RSF:
-            return "RSF"
+        return DIST_STYLE_PRETTY[self]
 
     def description(self) -> str:
-        if self is DistStyle.ORIGINAL:
-            return "Tracks share /Maps (Vanilla, TM, TrainingDay)"
-        elif self is DistStyle.RSF:
-            return "Tracks have separate folders in /Maps (RSF)"
+        return DIST_STYLE_DESCRIPTION[self]
+
+
+DIST_STYLE_PRETTY: Dict[DistStyle, str] = {
+    DistStyle.ORIGINAL: "Original",
+    DistStyle.RSF: "RSF",
+}
+
+DIST_STYLE_DESCRIPTION: Dict[DistStyle, str] = {
+    DistStyle.ORIGINAL: "Tracks share /Maps (Vanilla, TM, TrainingDay)",
+    DistStyle.RSF: "Tracks have separate folders in /Maps (RSF)",
+}
+
+# Enum members keyed by name, for reading enum properties
+DIST_STYLE_BY_NAME: Dict[str, DistStyle] = {x.name: x for x in DistStyle}
+LANGUAGE_BY_NAME: Dict[str, Language] = {x.name: x for x in Language}
+
+# Enum property items, these never change so only build them once
+DIST_STYLE_ITEMS: Tuple[Tuple[str, str, str, int], ...] = tuple(
+    (x.name, x.pretty(), x.description(), x.value) for x in DistStyle
+)
+LANGUAGE_ITEMS: Tuple[Tuple[str, str, str, int], ...] = tuple(
+    (x.name, x.pretty(), x.pretty(), x.value) for x in Language
+)
+
+
+# Export directories keyed by name, used by get_export_directory. Built lazily,
+# and thrown away whenever an export directory is added, removed or edited.
+# Reverting or reloading preferences re-registers the addon without any of
+# those, so it is also thrown away on register/unregister, and on file load.
+export_directory_cache: Optional[Dict[str, Tuple[str, DistStyle]]] = None
+
+
+@bpy.app.handlers.persistent  # type: ignore
+def invalidate_export_directory_cache(*args: Any) -> None:
+    global export_directory_cache
+    export_directory_cache = None
 
 
 class RBRExportDirectory(bpy.types.PropertyGroup):
     name: bpy.props.StringProperty(  # type: ignore
         name="Name",  # noqa: F821
+        update=invalidate_export_directory_cache,
     )
     directory: bpy.props.StringProperty(  # type: ignore
         name="RBR Maps Directory",  # noqa: F821
         subtype="DIR_PATH",  # noqa: F821
+        update=invalidate_export_directory_cache,
     )
     style: bpy.props.EnumProperty(  # type: ignore
         name="Style",  # noqa: F821
-        items=[(x.name, x.pretty(), x.description(), x.value) for x in DistStyle],
+        items=DIST_STYLE_ITEMS,
         default=DistStyle.ORIGINAL.name,
+        update=invalidate_export_directory_cache,
     )
 
 
@@ -46,6 +79,7 @@ class RBR_OT_add_export_directory(bpy.types.Operator):
     def invoke(self, context: bpy.types.Context, event: bpy.types.Event) -> Set[str]:
         prefs = context.preferences.addons["rbr_track_addon"].preferences
         prefs.export_directories.add()
+        invalidate_export_directory_cache()
         return {"FINISHED"}
 
 
@@ -59,6 +93,7 @@ class RBR_OT_remove_export_directory(bpy.types.Operator):
     def invoke(self, context: bpy.types.Context, event: bpy.types.Event) -> Set[str]:
         prefs = context.preferences.addons["rbr_track_addon"].preferences
         prefs.export_directories.remove(self.index)
+        invalidate_export_directory_cache()
         return {"FINISHED"}
 
 
@@ -70,19 +105,25 @@ class RBRAddonPreferences(bpy.types.AddonPreferences):
     )
 
     def get_export_directory(self, name: str) -> Optional[Tuple[str, DistStyle]]:
-        for export_directory in self.export_directories:
-            if export_directory.name == name:
-                return (export_directory.directory, DistStyle[export_directory.style])
-        return None
+        global export_directory_cache
+        if export_directory_cache is None:
+            export_directory_cache = {}
+            # Iterate in reverse so the first directory with a given name wins
+            for export_directory in reversed(self.export_directories):
+                export_directory_cache[export_directory.name] = (
+                    export_directory.directory,
+                    DIST_STYLE_BY_NAME[export_directory.style],
+                )
+        return export_directory_cache.get(name)
 
     language: bpy.props.EnumProperty(  # type: ignore
         name="Language",
-        items=[(x.name, x.pretty(), x.pretty(), x.value) for x in Language],
+        items=LANGUAGE_ITEMS,
         default=Language.EN.name,
     )
 
     def get_language(self) -> Language:
-        return Language[self.language]
+        return LANGUAGE_BY_NAME[self.language]
 
     def draw(self, context: bpy.types.Context) -> None:
         self.layout.prop(self, "language")
@@ -100,6 +141,8 @@ class RBRAddonPreferences(bpy.types.AddonPreferences):
 
 
 def register() -> None:
+    invalidate_export_directory_cache()
+    bpy.app.handlers.load_post.append(invalidate_export_directory_cache)
     bpy.utils.register_class(RBR_OT_remove_export_directory)
     bpy.utils.register_class(RBR_OT_add_export_directory)
     bpy.utils.register_class(RBRExportDirectory)
@@ -107,6 +150,11 @@ def register() -> None:
 
 
 def unregister() -> None:
+    try:
+        bpy.app.handlers.load_post.remove(invalidate_export_directory_cache)
+    except ValueError:
+        pass
+    invalidate_export_directory_cache()
     bpy.utils.unregister_class(RBRAddonPreferences)
     bpy.utils.unregister_class(RBRExportDirectory)
     bpy.utils.unregister_class(RBR_OT_add_export_directory)
@@ -1,7 +1,11 @@
-from typing import Dict
+from typing import Dict, Tuple
 
 import bpy  # type: ignore
 
+from ..physical_material_editor.properties import (
+    extend_material_maps,
+    migrate_material_maps_bounds,
+)
 from . import operator
 from . import properties
 from . import uv_velocity
@@ -9,16 +13,25 @@ from . import shader_node
 from . import sky
 from . import texture
 from . import time
-from . import utils  # noqa: F401
+from . import utils
+
+
+# (label, translation context) of node types shown in menus, keyed by node
+# type. These are fixed once the node is registered, and menus are redrawn a
+# lot.
+node_type_label_cache: Dict[str, Tuple[str, str]] = {}
 
 
 def add_node_type(
     layout: bpy.types.UILayout, node_type: str
 ) -> bpy.types.OperatorProperties:
     """Add a node type to a menu."""
-    bl_rna = bpy.types.Node.bl_rna_get_subclass(node_type)
-    label = bl_rna.name
-    translation_context = bl_rna.translation_context
+    cached = node_type_label_cache.get(node_type)
+    if cached is None:
+        bl_rna = bpy.types.Node.bl_rna_get_subclass(node_type)
+        cached = (bl_rna.name, bl_rna.translation_context)
+        node_type_label_cache[node_type] = cached
+    (label, translation_context) = cached
     props = layout.operator("node.add_node", text=label, text_ctxt=translation_context)
     props.type = node_type
     props.use_transform = True
@@ -57,6 +70,7 @@ def register() -> None:
 def unregister() -> None:
     bpy.types.NODE_MT_shader_node_add_all.remove(draw_rbr_shader_menu)
     bpy.utils.unregister_class(NODE_MT_category_RBR_SHADER)
+    node_type_label_cache.clear()
     operator.unregister()
     sky.unregister()
     shader_node.unregister()
@@ -69,8 +83,33 @@ def unregister() -> None:
 def set_colorspace(node_tree: bpy.types.NodeTree) -> None:
     for node in node_tree.nodes:
         if isinstance(node, bpy.types.ShaderNodeTexImage):
-            if node.image is not None:
-                node.image.colorspace_settings.name = "sRGB"
+            image = node.image
+            # Setting the colorspace reloads the image, even when it's
+            # unchanged, and images are often shared between several nodes.
+            if image is not None and image.colorspace_settings.name != "sRGB":
+                image.colorspace_settings.name = "sRGB"
+
+
+# Texture node names and the RBRTexture properties they were migrated from
+TEXTURE_IMAGE_SLOTS: Tuple[Tuple[str, str], ...] = (
+    ("dry/new", "dry_new"),
+    ("dry/normal", "dry_normal"),
+    ("dry/worn", "dry_worn"),
+    ("damp/new", "damp_new"),
+    ("damp/normal", "damp_normal"),
+    ("damp/worn", "damp_worn"),
+    ("wet/new", "wet_new"),
+    ("wet/normal", "wet_normal"),
+    ("wet/worn", "wet_worn"),
+)
+
+# Texture node names and the RBRSpecularTexture properties they were migrated
+# from
+SPECULAR_IMAGE_SLOTS: Tuple[Tuple[str, str], ...] = (
+    ("dry/new", "dry"),
+    ("damp/new", "damp"),
+    ("wet/new", "wet"),
+)
 
 
 def migrate_split_shaders() -> None:
@@ -78,39 +117,31 @@ def migrate_split_shaders() -> None:
     for rbr_texture in bpy.context.scene.rbr_textures.textures:
         node_tree = texture.setup_texture_node_tree()
         node_tree.name = texture.RBR_TEXTURE_NODE_TREE_PREFIX + rbr_texture.name
-        internal = node_tree.nodes["internal"]
+        nodes = node_tree.nodes
+        internal = nodes["internal"]
         internal.is_road_surface = rbr_texture.is_road_surface
-        for original in rbr_texture.material_maps:
-            new = internal.material_maps.add()
-            new.copy(original)
-        node_tree.nodes["dry/new"].image = rbr_texture.dry_new
-        node_tree.nodes["dry/normal"].image = rbr_texture.dry_normal
-        node_tree.nodes["dry/worn"].image = rbr_texture.dry_worn
-        node_tree.nodes["damp/new"].image = rbr_texture.damp_new
-        node_tree.nodes["damp/normal"].image = rbr_texture.damp_normal
-        node_tree.nodes["damp/worn"].image = rbr_texture.damp_worn
-        node_tree.nodes["wet/new"].image = rbr_texture.wet_new
-        node_tree.nodes["wet/normal"].image = rbr_texture.wet_normal
-        node_tree.nodes["wet/worn"].image = rbr_texture.wet_worn
+        # The corners are copied as bounds, which these old maps predate
+        migrate_material_maps_bounds(rbr_texture.material_maps)
+        extend_material_maps(internal.material_maps, rbr_texture.material_maps)
+        for node_name, attr in TEXTURE_IMAGE_SLOTS:
+            nodes[node_name].image = getattr(rbr_texture, attr)
         set_colorspace(node_tree)
         texture_trees[rbr_texture.name] = node_tree
     specular_texture_trees = dict()
     for rbr_texture in bpy.context.scene.rbr_textures.specular_textures:
         node_tree = texture.setup_texture_node_tree()
         node_tree.name = texture.RBR_TEXTURE_NODE_TREE_PREFIX + rbr_texture.name
-        internal = node_tree.nodes["internal"]
-        node_tree.nodes["dry/new"].image = rbr_texture.dry
-        node_tree.nodes["damp/new"].image = rbr_texture.damp
-        node_tree.nodes["wet/new"].image = rbr_texture.wet
+        nodes = node_tree.nodes
+        for node_name, attr in SPECULAR_IMAGE_SLOTS:
+            nodes[node_name].image = getattr(rbr_texture, attr)
         set_colorspace(node_tree)
         specular_texture_trees[rbr_texture.name] = node_tree
-    for material in bpy.data.materials:
-        if material.use_nodes:
-            migrate_node_tree(
-                node_tree=material.node_tree,
-                texture_trees=texture_trees,
-                specular_texture_trees=specular_texture_trees,
-            )
+    for _, node_tree in utils.node_materials():
+        migrate_node_tree(
+            node_tree=node_tree,
+            texture_trees=texture_trees,
+            specular_texture_trees=specular_texture_trees,
+        )
 
 
 def migrate_node_tree(
@@ -118,40 +149,51 @@ def migrate_node_tree(
     texture_trees: Dict[str, bpy.types.NodeTree],
     specular_texture_trees: Dict[str, bpy.types.NodeTree],
 ) -> None:
-    for node in node_tree.nodes:
-        if isinstance(node, shader_node.ShaderNodeRBR):
-            diffuse_1 = texture_trees.get(node.diffuse_1)
-            if diffuse_1 is None:
-                node.has_diffuse_1 = False
-            else:
-                node.has_diffuse_1 = True
+    # Take the RBR nodes up front, since creating textures adds nodes to the
+    # tree as we go.
+    rbr_nodes = [
+        node for node in node_tree.nodes if isinstance(node, shader_node.ShaderNodeRBR)
+    ]
+    # Old nodes had separate UV settings for every slot, which could be edited
+    # independently. Keep that, with a UV node for each slot rather than
+    # sharing them between slots which happen to match.
+    for node in rbr_nodes:
+        inputs = node.inputs
+        diffuse_1 = texture_trees.get(node.diffuse_1)
+        if diffuse_1 is None:
+            node.has_diffuse_1 = False
+        else:
+            node.has_diffuse_1 = True
+            shader_node.create_texture_and_uv(
+                node_tree=node_tree,
+                tex_tree=diffuse_1,
+                uv_layer=node.diffuse_1_uv,
+                color=inputs["Diffuse Texture 1"],
+                alpha=inputs["Diffuse Texture 1 Alpha"],
+                uv_velocity=node.diffuse_1_velocity,
+                uv_sockets=dict(),
+            )
+            diffuse_2 = texture_trees.get(node.diffuse_2)
+            if diffuse_2 is not None:
+                node.has_diffuse_2 = True
+                shader_node.create_texture_and_uv(
+                    node_tree=node_tree,
+                    tex_tree=diffuse_2,
+                    uv_layer=node.diffuse_2_uv,
+                    color=inputs["Diffuse Texture 2"],
+                    alpha=inputs["Diffuse Texture 2 Alpha"],
+                    uv_velocity=node.diffuse_2_velocity,
+                    uv_sockets=dict(),
+                )
+            specular = specular_texture_trees.get(node.specular)
+            if specular is not None:
+                node.has_specular = True
                 shader_node.create_texture_and_uv(
                     node_tree=node_tree,
-                    tex_tree=diffuse_1,
-                    uv_layer=node.diffuse_1_uv,
-                    color=node.inputs["Diffuse Texture 1"],
-                    alpha=node.inputs["Diffuse Texture 1 Alpha"],
-                    uv_velocity=node.diffuse_1_velocity,
+                    tex_tree=specular,
+                    uv_layer=node.specular_uv,
+                    color=inputs["Specular Texture"],
+                    alpha=inputs["Specular Texture Alpha"],
+                    uv_velocity=node.specular_velocity,
+                    uv_sockets=dict(),
                 )
-                diffuse_2 = texture_trees.get(node.diffuse_2)
-                if diffuse_2 is not None:
-                    node.has_diffuse_2 = True
-                    shader_node.create_texture_and_uv(
-                        node_tree=node_tree,
-                        tex_tree=diffuse_2,
-                        uv_layer=node.diffuse_2_uv,
-                        color=node.inputs["Diffuse Texture 2"],
-                        alpha=node.inputs["Diffuse Texture 2 Alpha"],
-                        uv_velocity=node.diffuse_2_velocity,
-                    )
-                specular = specular_texture_trees.get(node.specular)
-                if specular is not None:
-                    node.has_specular = True
-                    shader_node.create_texture_and_uv(
-                        node_tree=node_tree,
-                        tex_tree=specular,
-                        uv_layer=node.specular_uv,
-                        color=node.inputs["Specular Texture"],
-                        alpha=node.inputs["Specular Texture Alpha"],
-                        uv_velocity=node.specular_velocity,
-                    )
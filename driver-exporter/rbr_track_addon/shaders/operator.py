@@ -1,4 +1,4 @@
-from typing import Dict, List, Set, Tuple
+from typing import Dict, List, NamedTuple, Set
 
 import bpy  # type: ignore
 
@@ -6,49 +6,70 @@ from ..object_settings.types import RBRObjectType
 from . import shader_node
 from . import sky
 from . import texture
+from .utils import node_materials
 
 
-def pop_links() -> Dict[str, List[Tuple[str, str, str, str]]]:
-    materials_to_relink: Dict[str, List[Tuple[str, str, str, str]]] = dict()
+class SavedLink(NamedTuple):
+    """A link to or from an RBR node, recorded by node and socket name"""
+
+    from_node: str
+    from_socket: str
+    to_node: str
+    to_socket: str
+
+
+# Nodes whose links need to be recreated when shaders are refreshed
+RBR_NODE_TYPES = (shader_node.ShaderNodeRBR, texture.ShaderNodeRBRTexture)
 
-    def node_is_rbr(node: bpy.types.Node) -> bool:
-        return isinstance(node, shader_node.ShaderNodeRBR) or isinstance(
-            node, texture.ShaderNodeRBRTexture
-        )
 
-    for material in bpy.data.materials:
-        if not material.use_nodes:
+def pop_links() -> Dict[str, List[SavedLink]]:
+    materials_to_relink: Dict[str, List[SavedLink]] = dict()
+
+    for material, node_tree in node_materials():
+        links = node_tree.links
+        relink: List[SavedLink] = []
+        materials_to_relink[material.name] = relink
+        rbr_node_names = {
+            node.name for node in node_tree.nodes if isinstance(node, RBR_NODE_TYPES)
+        }
+        if not rbr_node_names:
             continue
-        materials_to_relink[material.name] = []
-        for link in material.node_tree.links:
-            if node_is_rbr(link.from_node) or node_is_rbr(link.to_node):
-                materials_to_relink[material.name].append(
-                    (
-                        link.from_node.name,
-                        link.from_socket.name,
-                        link.to_node.name,
-                        link.to_socket.name,
+        # Record everything first, so the links collection isn't modified
+        # while we walk it.
+        to_remove = []
+        for link in links:
+            from_node_name = link.from_node.name
+            to_node_name = link.to_node.name
+            if from_node_name in rbr_node_names or to_node_name in rbr_node_names:
+                relink.append(
+                    SavedLink(
+                        from_node=from_node_name,
+                        from_socket=link.from_socket.name,
+                        to_node=to_node_name,
+                        to_socket=link.to_socket.name,
                     )
                 )
-            else:
-                continue
-            # Unlink now we have recorded it
-            material.node_tree.links.remove(link)
+                to_remove.append(link)
+        # Unlink now we have recorded them
+        remove_link = links.remove
+        for link in to_remove:
+            remove_link(link)
 
     return materials_to_relink
 
 
-def push_links(links: Dict[str, List[Tuple[str, str, str, str]]]) -> None:
+def push_links(links: Dict[str, List[SavedLink]]) -> None:
     for material_name, missing_links in links.items():
+        if not missing_links:
+            continue
         node_tree = bpy.data.materials[material_name].node_tree
-        for (
-            from_node_name,
-            from_socket_name,
-            to_node_name,
-            to_socket_name,
-        ) in missing_links:
-            from_node = node_tree.nodes[from_node_name]
-            to_node = node_tree.nodes[to_node_name]
+        nodes_by_name = {node.name: node for node in node_tree.nodes}
+        new_link = node_tree.links.new
+        for saved in missing_links:
+            from_node = nodes_by_name[saved.from_node]
+            to_node = nodes_by_name[saved.to_node]
+            from_socket_name = saved.from_socket
+            to_socket_name = saved.to_socket
             if (
                 isinstance(from_node, texture.ShaderNodeRBRTexture)
                 and from_socket_name == "RBR Texture"
@@ -58,34 +79,50 @@ def push_links(links: Dict[str, List[Tuple[str, str, str, str]]]) -> None:
                 # Create the alpha socket link too automatically
                 if isinstance(to_node, shader_node.ShaderNodeRBR):
                     if to_socket_name == shader_node.RBR_DIFFUSE_1_TEXTURE_INPUT:
-                        node_tree.links.new(
+                        new_link(
                             from_node.outputs[texture.RBR_TEXTURE_ALPHA_OUTPUT],
                             to_node.inputs[shader_node.RBR_DIFFUSE_1_ALPHA_INPUT],
                         )
                     elif to_socket_name == shader_node.RBR_DIFFUSE_2_TEXTURE_INPUT:
-                        node_tree.links.new(
+                        new_link(
                             from_node.outputs[texture.RBR_TEXTURE_ALPHA_OUTPUT],
                             to_node.inputs[shader_node.RBR_DIFFUSE_2_ALPHA_INPUT],
                         )
-            node_tree.links.new(
+            new_link(
                 from_node.outputs[from_socket_name],
                 to_node.inputs[to_socket_name],
             )
 
 
-def refresh_all_rbr_shaders(context: bpy.types.Context) -> None:
+def refresh_all_rbr_shaders(
+    context: bpy.types.Context,
+    *,
+    update_world: bool = True,
+    update_sky: bool = True,
+    only_changed: bool = False,
+) -> None:
     links = pop_links()
     sky.recreate_internals()
-    shader_node.recreate_internals(context)
+    shader_node.recreate_internals(context, only_changed=only_changed)
     for _, node_tree in texture.all_rbr_texture_node_trees_filename():
         texture.recreate_internals(context, node_tree)
     push_links(links)
+    type_values = {t.name: t.value for t in RBRObjectType}
+    changed_objects = []
     for obj in bpy.data.objects:
-        obj.rbr_object_type_value = RBRObjectType[obj.rbr_object_settings.type].value
-        # Must also force an update here
+        type_value = type_values[obj.rbr_object_settings.type]
+        # Tagging objects is expensive, so leave those which are up to date
+        if obj.rbr_object_type_value != type_value:
+            obj.rbr_object_type_value = type_value
+            changed_objects.append(obj)
+    # Must also force an update here. Do it after all values are written, so
+    # the depsgraph sees every change in one go.
+    for obj in changed_objects:
         obj.update_tag()
-    context.scene.rbr_track_settings.update_world_context(context)
-    context.scene.rbr_track_settings.update_sky_values()
+    if update_world:
+        context.scene.rbr_track_settings.update_world_context(context)
+    if update_sky:
+        context.scene.rbr_track_settings.update_sky_values()
 
 
 class RBR_OT_refresh_shaders(bpy.types.Operator):
@@ -96,8 +133,23 @@ class RBR_OT_refresh_shaders(bpy.types.Operator):
     bl_label = "Recreate RBR shader trees"
     bl_options = {"REGISTER", "UNDO"}
 
+    update_world: bpy.props.BoolProperty(  # type: ignore
+        name="Update World",
+        description="Also set up the world for the active weather",
+        default=True,
+    )
+    only_changed: bpy.props.BoolProperty(  # type: ignore
+        name="Only Changed",
+        description="Skip RBR shader trees built with the current shader settings",
+        default=False,
+    )
+
     def execute(self, context: bpy.types.Context) -> Set[str]:
-        refresh_all_rbr_shaders(context)
+        refresh_all_rbr_shaders(
+            context,
+            update_world=self.update_world,
+            only_changed=self.only_changed,
+        )
         return {"FINISHED"}
 
 
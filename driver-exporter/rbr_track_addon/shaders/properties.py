@@ -1,3 +1,5 @@
+from typing import Any
+
 import bpy  # type: ignore
 
 RBR_COLOR_EXPORT_LAYER: str = "RBR_COLOR_EXPORT"
@@ -10,8 +12,12 @@ class RBRGlobalShaderFlags(bpy.types.PropertyGroup):
     """
 
     def __update_shading_type__(self, context: bpy.types.Context) -> None:
-        bpy.ops.rbr.refresh_shaders()
-        bpy.context.scene.rbr_track_settings.update_sky_values()
+        # Refreshing shaders is slow, so coalesce several flag changes in
+        # quick succession (e.g. from a script) into a single refresh.
+        global refresh_pending
+        if not refresh_pending:
+            refresh_pending = True
+            bpy.app.timers.register(deferred_refresh_shaders, first_interval=0.05)
 
     realtime_displacement: bpy.props.BoolProperty(  # type: ignore
         name="Realtime Displacement",
@@ -36,6 +42,30 @@ class RBRGlobalShaderFlags(bpy.types.PropertyGroup):
         layout.prop(self, "only_display_alpha")
 
 
+# Whether a deferred shader refresh has been scheduled
+refresh_pending: bool = False
+
+
+def deferred_refresh_shaders() -> None:
+    global refresh_pending
+    refresh_pending = False
+    # The flags only change the RBR shader trees, not the world. The refresh
+    # already updates the sky values. Flags toggled back and forth before the
+    # refresh runs leave the trees as they are.
+    bpy.ops.rbr.refresh_shaders(update_world=False, only_changed=True)
+
+
+@bpy.app.handlers.persistent  # type: ignore
+def cancel_deferred_refresh(*args: Any) -> None:
+    # Loading a file drops non-persistent timers without running them, which
+    # would leave refresh_pending set and block every later refresh. The
+    # refresh belongs to the file being closed, so cancel it outright.
+    global refresh_pending
+    if bpy.app.timers.is_registered(deferred_refresh_shaders):
+        bpy.app.timers.unregister(deferred_refresh_shaders)
+    refresh_pending = False
+
+
 class RBR_PT_global_shader_flags(bpy.types.Panel):
     bl_idname = "RBR_PT_global_shader_flags"
     bl_label = "RBR Shader Settings"
@@ -53,9 +83,15 @@ def register() -> None:
         type=RBRGlobalShaderFlags,
     )
     bpy.utils.register_class(RBR_PT_global_shader_flags)
+    bpy.app.handlers.load_pre.append(cancel_deferred_refresh)
 
 
 def unregister() -> None:
+    try:
+        bpy.app.handlers.load_pre.remove(cancel_deferred_refresh)
+    except ValueError:
+        pass
+    cancel_deferred_refresh()
     bpy.utils.unregister_class(RBR_PT_global_shader_flags)
     del bpy.types.Scene.rbr_global_shader_flags
     bpy.utils.unregister_class(RBRGlobalShaderFlags)
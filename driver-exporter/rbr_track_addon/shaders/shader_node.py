@@ -11,8 +11,8 @@ better off using a custom OpenGL render engine.
 https://github.com/RichardBurnsRally/blender-rbr-track-addon/issues/152
 """
 
-from dataclasses import dataclass
-from typing import List, Optional, Tuple, Union
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 import math
 
 from rbr_track_formats import errors
@@ -31,6 +31,7 @@ from .texture import (
 from .utils import (
     make_math_node,
     mix_rgb,
+    mix_value,
     srgb_to_linear,
     vector_multiply,
     vector_scale,
@@ -63,20 +64,6 @@ VC_SWAY_FREQUENCY: str = "RBR_SWAY_FREQUENCY"
 VC_SWAY_PHASE: str = "RBR_SWAY_PHASE"
 
 
-def wrap_with_debug_shader(
-    color_socket: bpy.types.NodeSocket,
-    alpha_socket: bpy.types.NodeSocket,
-    other_shader_socket: bpy.types.NodeSocket,
-) -> bpy.types.NodeSocket:
-    if bpy.context.scene.rbr_global_shader_flags.only_display_color:
-        socket = color_socket
-    elif bpy.context.scene.rbr_global_shader_flags.only_display_alpha:
-        socket = alpha_socket
-    else:
-        socket = other_shader_socket
-    return socket
-
-
 def get_object_type(node_tree: bpy.types.NodeTree) -> bpy.types.NodeSocket:
     node = node_tree.nodes.new("ShaderNodeAttribute")
     node.attribute_type = "OBJECT"
@@ -98,13 +85,33 @@ def check_object_type(
     )
 
 
-@dataclass
+@dataclass(slots=True)
+class ObjectTypeCache:
+    """The object type attribute of a node tree, along with comparisons
+    against each object type. Each comparison is only made once per tree, no
+    matter how many places use it."""
+
+    node_tree: bpy.types.NodeTree
+    object_type_socket: bpy.types.NodeSocket
+    checks: Dict[RBRObjectType, bpy.types.NodeSocket] = field(default_factory=dict)
+
+    def check(self, object_type: RBRObjectType) -> bpy.types.NodeSocket:
+        socket = self.checks.get(object_type)
+        if socket is None:
+            socket = check_object_type(
+                self.node_tree, self.object_type_socket, object_type
+            )
+            self.checks[object_type] = socket
+        return socket
+
+
+@dataclass(slots=True)
 class PipelineType:
     color: bpy.types.NodeSocket
     alpha: bpy.types.NodeSocket
     # We only need to override the amplitude for non object block objects.
     sway_amp: bpy.types.NodeSocket
-    specular: bpy.types.NodeSocket
+    specular: Union[float, bpy.types.NodeSocket]
 
 
 def multiply_scattering(
@@ -112,25 +119,15 @@ def multiply_scattering(
     vcol_in: bpy.types.NodeSocketColor,
     sun_dir: bpy.types.NodeSocketVector,
     light_dir: bpy.types.NodeSocketVector,
+    view_vector: bpy.types.NodeSocketVector,
+    view_depth: bpy.types.NodeSocketFloat,
+    object_types: ObjectTypeCache,
 ) -> Tuple[bpy.types.NodeSocketColor, bpy.types.NodeSocketColor]:
-    geo_node = node_tree.nodes.new("ShaderNodeNewGeometry")
-    # geo_node.outputs["Position"]
-
     turbidity = sky.make_value(node_tree, sky.SKY_TURBIDITY)
-    camera_data = node_tree.nodes.new("ShaderNodeCameraData")
-    view_depth = camera_data.outputs["View Z Depth"]
-    # Left hand view vector to match left hand light dir
-    view_vector = sky.flip_handedness(node_tree, geo_node.outputs["Incoming"])
-    # view_vector = vector_scale(node_tree, vector=geo_node.outputs["Incoming"], scale=-1.0)
     # Different scale for different object types
-    object_type_socket = get_object_type(node_tree)
-    is_superbowl = check_object_type(
-        node_tree, object_type_socket, RBRObjectType.SUPER_BOWL
-    )
-    is_not_superbowl = make_math_node(node_tree, "SUBTRACT", in1=1.0, in2=is_superbowl)
+    is_superbowl = object_types.check(RBRObjectType.SUPER_BOWL)
     superbowl_scale = sky.make_value(node_tree, sky.SKY_SUPERBOWL_SCALE)
-    scale = make_math_node(node_tree, "MULTIPLY", in1=is_superbowl, in2=superbowl_scale)
-    scale = make_math_node(node_tree, "ADD", in1=scale, in2=is_not_superbowl)
+    scale = mix_value(node_tree, fac=is_superbowl, a=1.0, b=superbowl_scale)
     scattering_depth = make_math_node(node_tree, "MULTIPLY", in1=view_depth, in2=scale)
     (r1, rayleigh_mie) = sky.setup_rayleigh_mie_nodes(
         node_tree=node_tree,
@@ -164,9 +161,12 @@ def multiply_scattering(
     # Sun intensity
     sun_intensity = make_value(node_tree, sky.SKY_SUN_INTENSITY)
 
+    # Both results are scaled by the transmitted sun light, so work that out
+    # once.
+    sun_light = vector_scale(node_tree, vector=transmittance, scale=sun_intensity)
+
     add_result = vector_scale(node_tree, vector=rayleigh_mie, scale=inscattering)
-    add_result = vector_multiply(node_tree, v1=add_result, v2=transmittance)
-    add_result = vector_scale(node_tree, vector=add_result, scale=sun_intensity)
+    add_result = vector_multiply(node_tree, v1=add_result, v2=sun_light)
 
     # MULTIPLY
     mul_result = vector_multiply(node_tree, v1=r1, v2=terrain_reflectance)
@@ -174,8 +174,7 @@ def multiply_scattering(
     extinction = make_value(node_tree, sky.SKY_EXTINCTION)
     mul_result = vector_scale(node_tree, vector=mul_result, scale=extinction)
     # Multiply transmittance
-    mul_result = vector_multiply(node_tree, v1=mul_result, v2=transmittance)
-    mul_result = vector_scale(node_tree, vector=mul_result, scale=sun_intensity)
+    mul_result = vector_multiply(node_tree, v1=mul_result, v2=sun_light)
 
     return (
         mix_rgb(
@@ -190,56 +189,189 @@ def multiply_scattering(
     )
 
 
+SWAY_NODE_TREE_NAME: str = ".RBRSwayNodeTreeV0"
+
+
+def setup_sway_node_tree(node_tree: bpy.types.NodeTree) -> None:
+    """The sway displacement is the same for every render type, so it's kept in
+    a single group shared by all of the RBR shader trees."""
+    # Reset if already present
+    node_tree.links.clear()
+    node_tree.nodes.clear()
+    node_tree.interface.clear()
+    # Create the internal group input and output nodes
+    node_tree.nodes.new("NodeGroupInput")
+    node_tree.nodes.new("NodeGroupOutput")
+    # Add the input and output sockets (this also adjusts the group
+    # inputs/outputs)
+    for name in [
+        RBR_SWAY_FREQ_INPUT_NAME,
+        RBR_SWAY_AMP_INPUT_NAME,
+        RBR_SWAY_PHASE_INPUT_NAME,
+        "Time",
+    ]:
+        node_tree.interface.new_socket(
+            name, in_out="INPUT", socket_type="NodeSocketFloat"
+        )
+    node_tree.interface.new_socket(
+        "Displacement", in_out="OUTPUT", socket_type="NodeSocketVector"
+    )
+    group_input = node_tree.nodes["Group Input"].outputs
+    disp_pre_sin = make_math_node(
+        node_tree,
+        "MULTIPLY_ADD",
+        group_input[RBR_SWAY_FREQ_INPUT_NAME],
+        group_input["Time"],
+        group_input[RBR_SWAY_PHASE_INPUT_NAME],
+    )
+    disp_sin = make_math_node(
+        node_tree,
+        "SINE",
+        disp_pre_sin,
+    )
+    sway_displacement_value = make_math_node(
+        node_tree,
+        "MULTIPLY",
+        disp_sin,
+        group_input[RBR_SWAY_AMP_INPUT_NAME],
+    )
+    # There is a wind strength coefficient hardcoded to 0.15.
+    sway_displacement_coeff = make_math_node(
+        node_tree,
+        "MULTIPLY",
+        sway_displacement_value,
+        # I don't know why we need this to be half the expected value.
+        # Maybe the 'sin' implementation is bad.
+        0.15 * 0.5,
+    )
+    # RBR only sways in X direction, it's hardcoded in the vertex shader.
+    sway_displacement_node = node_tree.nodes.new("ShaderNodeCombineXYZ")
+    node_tree.links.new(
+        sway_displacement_node.inputs["X"],
+        sway_displacement_coeff,
+    )
+    node_tree.links.new(
+        node_tree.nodes["Group Output"].inputs["Displacement"],
+        sway_displacement_node.outputs["Vector"],
+    )
+
+
+def use_sway_node_tree() -> bpy.types.NodeTree:
+    node_tree = bpy.data.node_groups.get(SWAY_NODE_TREE_NAME)
+    if node_tree is None:
+        node_tree = bpy.data.node_groups.new(SWAY_NODE_TREE_NAME, "ShaderNodeTree")
+        setup_sway_node_tree(node_tree)
+    return node_tree
+
+
+def make_sway_displacement(
+    node_tree: bpy.types.NodeTree,
+    flags: RBRGlobalShaderFlags,
+    sway_freq: bpy.types.NodeSocketFloat,
+    sway_amp: bpy.types.NodeSocket,
+    sway_phase: bpy.types.NodeSocketFloat,
+) -> bpy.types.NodeSocketVector:
+    # Compute displacement
+    # It's really slow (when playing the timeline) so we disable it by default.
+    # Note that disabling this after enabling it may still be laggy until the
+    # material shader node is modified.
+    if flags.realtime_displacement:
+        time = node_tree.nodes.new("ShaderNodeTime").outputs["Time"]
+    else:
+        time = node_tree.nodes.new("ShaderNodeValue").outputs[0]
+    sway = node_tree.nodes.new("ShaderNodeGroup")
+    sway.node_tree = use_sway_node_tree()
+    inputs = sway.inputs
+    node_tree.links.new(inputs[RBR_SWAY_FREQ_INPUT_NAME], sway_freq)
+    node_tree.links.new(inputs[RBR_SWAY_AMP_INPUT_NAME], sway_amp)
+    node_tree.links.new(inputs[RBR_SWAY_PHASE_INPUT_NAME], sway_phase)
+    node_tree.links.new(inputs["Time"], time)
+    return sway.outputs["Displacement"]
+
+
 def make_bsdf(
     node_tree: bpy.types.NodeTree,
     render_type: RenderType,
+    flags: RBRGlobalShaderFlags,
 ) -> Tuple[bpy.types.NodeSocketShader, bpy.types.NodeSocketVector]:
     """Returns (surface socket, displacement socket). We can't branch on shading
     type while building this, because a single tree is used for all shadinr
     types.
     """
+    group_input = node_tree.nodes["Group Input"].outputs
     if render_type.has_diffuse_1():
-        diffuse_1_color = node_tree.nodes["Group Input"].outputs[
-            RBR_DIFFUSE_1_TEXTURE_INPUT
-        ]
-        diffuse_1_alpha = node_tree.nodes["Group Input"].outputs[
-            RBR_DIFFUSE_1_ALPHA_INPUT
-        ]
+        diffuse_1_color = group_input[RBR_DIFFUSE_1_TEXTURE_INPUT]
+        diffuse_1_alpha = group_input[RBR_DIFFUSE_1_ALPHA_INPUT]
         if render_type.has_diffuse_2():
-            diffuse_2_color = node_tree.nodes["Group Input"].outputs[
-                RBR_DIFFUSE_2_TEXTURE_INPUT
-            ]
-            diffuse_2_alpha = node_tree.nodes["Group Input"].outputs[
-                RBR_DIFFUSE_2_ALPHA_INPUT
-            ]
+            diffuse_2_color = group_input[RBR_DIFFUSE_2_TEXTURE_INPUT]
+            diffuse_2_alpha = group_input[RBR_DIFFUSE_2_ALPHA_INPUT]
         if render_type.has_specular():
-            specular_color = node_tree.nodes["Group Input"].outputs[
-                RBR_SPECULAR_TEXTURE_INPUT
-            ]
-            vcol_spec = node_tree.nodes["Group Input"].outputs[
-                RBR_SPECULAR_STRENGTH_INPUT_NAME
-            ]
+            specular_color = group_input[RBR_SPECULAR_TEXTURE_INPUT]
+            vcol_spec = group_input[RBR_SPECULAR_STRENGTH_INPUT_NAME]
+    # This is actually sRGB already
+    vcol_in = group_input[RBR_COLOR_INPUT_NAME]
+    vcol_alpha = group_input[RBR_ALPHA_INPUT_NAME]
+    # Sway inputs to the displacement socket
+    sway_freq = group_input[RBR_SWAY_FREQ_INPUT_NAME]
+    sway_amp = group_input[RBR_SWAY_AMP_INPUT_NAME]
+    sway_phase = group_input[RBR_SWAY_PHASE_INPUT_NAME]
+    # Tweaks for different object types all read the same object type
+    # attribute, so share that and the comparisons made against it.
+    object_types = ObjectTypeCache(
+        node_tree=node_tree,
+        object_type_socket=get_object_type(node_tree),
+    )
+
+    # The debug display modes show the vertex color or alpha directly, so
+    # don't build the rest of the shader for them. Sway still applies, and
+    # only object blocks sway (see tweak_object_blocks).
+    def debug_output(
+        socket: bpy.types.NodeSocket,
+    ) -> Tuple[bpy.types.NodeSocket, bpy.types.NodeSocketVector]:
+        object_block_sway_amp = make_math_node(
+            node_tree,
+            "MULTIPLY",
+            sway_amp,
+            object_types.check(RBRObjectType.OBJECT_BLOCKS),
+        )
+        return (
+            socket,
+            make_sway_displacement(
+                node_tree=node_tree,
+                flags=flags,
+                sway_freq=sway_freq,
+                sway_amp=object_block_sway_amp,
+                sway_phase=sway_phase,
+            ),
+        )
+
+    if flags.only_display_alpha and not flags.only_display_color:
+        return debug_output(vcol_alpha)
+
     sun_dir = make_vector_value(node_tree, sky.SKY_SUN_DIR)
     light_dir = vector_scale(node_tree, vector=sun_dir, scale=-1.0)
-    # This is actually sRGB already
-    vcol_in = node_tree.nodes["Group Input"].outputs[RBR_COLOR_INPUT_NAME]
-    flags: RBRGlobalShaderFlags = bpy.context.scene.rbr_global_shader_flags
+    # Camera and geometry data are read by scattering, fog and specular, so
+    # share one node of each.
+    camera_data = node_tree.nodes.new("ShaderNodeCameraData")
     # Scattering, only for RBR mode with textures
     if render_type.has_diffuse_1():
+        geometry = node_tree.nodes.new("ShaderNodeNewGeometry")
+        # Left hand view vector to match left hand light dir
+        view_vector = sky.flip_handedness(node_tree, geometry.outputs["Incoming"])
         (vcol, add_scattering) = multiply_scattering(
             node_tree=node_tree,
             vcol_in=vcol_in,
             sun_dir=sun_dir,
             light_dir=light_dir,
+            view_vector=view_vector,
+            view_depth=camera_data.outputs["View Z Depth"],
+            object_types=object_types,
         )
     else:
         vcol = vcol_in
         add_scattering = (0, 0, 0, 0)
-    vcol_alpha = node_tree.nodes["Group Input"].outputs[RBR_ALPHA_INPUT_NAME]
-    # Sway inputs to the displacement socket
-    sway_freq = node_tree.nodes["Group Input"].outputs[RBR_SWAY_FREQ_INPUT_NAME]
-    sway_amp = node_tree.nodes["Group Input"].outputs[RBR_SWAY_AMP_INPUT_NAME]
-    sway_phase = node_tree.nodes["Group Input"].outputs[RBR_SWAY_PHASE_INPUT_NAME]
+    if flags.only_display_color:
+        return debug_output(vcol)
 
     if not render_type.has_diffuse_1():
         diffuse = vcol
@@ -307,229 +439,177 @@ def make_bsdf(
     # Tweak the visible alpha and color values to match RBR for each object
     # type. We do this by building a chain of mix shaders using a type
     # comparison as the factor input.
-    object_type_socket = get_object_type(node_tree)
-
     BROKEN_COLOR = (1, 0, 0, 1)
-    BROKEN_ALPHA = (1, 1, 1, 1)
+    BROKEN_ALPHA = 1.0
+
+    # The tweaks mix against the same few constant colours many times over, so
+    # make a single RGB node for each and link that instead.
+    const_colors: Dict[Tuple[float, float, float, float], bpy.types.NodeSocket] = {}
+
+    def const_color(
+        rgba: Tuple[float, float, float, float],
+    ) -> bpy.types.NodeSocket:
+        socket = const_colors.get(rgba)
+        if socket is None:
+            socket = node_tree.nodes.new("ShaderNodeRGB").outputs["Color"]
+            socket.default_value = rgba
+            const_colors[rgba] = socket
+        return socket
 
     def clip(in_socket: Union[float, bpy.types.NodeSocket]) -> bpy.types.NodeSocket:
         return make_math_node(node_tree, "LESS_THAN", 0.8, in_socket)
 
+    # Turn off specular for object types which don't support it.
+    def without_specular(
+        fac: bpy.types.NodeSocket,
+        specular: Union[float, bpy.types.NodeSocket],
+    ) -> Union[float, bpy.types.NodeSocket]:
+        # The pipeline specular value is only used with a specular texture, so
+        # don't build nodes which would never be read.
+        if not render_type.has_specular():
+            return specular
+        # Specular starts at 1, and an object only has one type, so
+        # subtracting each type check zeroes it for exactly those types. This
+        # is a single math node, where a mix to black was a colour mix.
+        return make_math_node(node_tree, "SUBTRACT", specular, fac)
+
+    # Each tweak updates the pipeline in place, one value flows through the
+    # whole chain.
+
     # Textured geom blocks don't have alpha support
     def tweak_geom_blocks(inp: PipelineType) -> PipelineType:
-        color_out = inp.color
-        is_geom_block = check_object_type(
-            node_tree, object_type_socket, RBRObjectType.GEOM_BLOCKS
-        )
         if render_type.has_diffuse_1():
-            alpha_out = mix_rgb(
+            inp.alpha = mix_value(
                 node_tree=node_tree,
-                fac=is_geom_block,
+                fac=object_types.check(RBRObjectType.GEOM_BLOCKS),
                 a=inp.alpha,
-                b=(1, 1, 1, 1),
+                b=1.0,
             )
-        else:
-            alpha_out = inp.alpha
-        return PipelineType(
-            color=color_out,
-            alpha=alpha_out,
-            sway_amp=inp.sway_amp,
-            specular=inp.specular,
-        )
+        return inp
 
     # Object blocks only support exactly one diffuse texture.
     def tweak_object_blocks(inp: PipelineType) -> PipelineType:
-        is_object_block = check_object_type(
-            node_tree, object_type_socket, RBRObjectType.OBJECT_BLOCKS
-        )
-        if render_type.has_diffuse_1() and not render_type.has_diffuse_2():
-            color_out = inp.color
-            alpha_out = inp.alpha
-        else:
-            color_out = mix_rgb(
+        is_object_block = object_types.check(RBRObjectType.OBJECT_BLOCKS)
+        if not render_type.has_diffuse_1() or render_type.has_diffuse_2():
+            inp.color = mix_rgb(
                 node_tree=node_tree,
                 fac=is_object_block,
                 a=inp.color,
-                b=BROKEN_COLOR,
+                b=const_color(BROKEN_COLOR),
             )
-            alpha_out = mix_rgb(
+            inp.alpha = mix_value(
                 node_tree=node_tree,
                 fac=is_object_block,
                 a=inp.alpha,
                 b=BROKEN_ALPHA,
             )
-        sway_out = mix_rgb(
-            node_tree=node_tree,
-            fac=is_object_block,
-            a=(0, 0, 0, 0),
-            b=inp.sway_amp,
-        )
-        specular_out = mix_rgb(
-            node_tree=node_tree,
-            fac=is_object_block,
-            a=inp.specular,
-            b=(0, 0, 0, 0),
-        )
-        return PipelineType(
-            color=color_out,
-            alpha=alpha_out,
-            sway_amp=sway_out,
-            specular=specular_out,
+        inp.sway_amp = make_math_node(
+            node_tree, "MULTIPLY", inp.sway_amp, is_object_block
         )
+        inp.specular = without_specular(fac=is_object_block, specular=inp.specular)
+        return inp
 
     # Super bowl objects don't have alpha or specular support, and the single
     # texture case clips at 80% opacity
     def tweak_super_bowl(inp: PipelineType) -> PipelineType:
-        is_super_bowl = check_object_type(
-            node_tree, object_type_socket, RBRObjectType.SUPER_BOWL
-        )
+        is_super_bowl = object_types.check(RBRObjectType.SUPER_BOWL)
         if render_type.has_diffuse_1() and not render_type.has_diffuse_2():
             alpha_in = clip(inp.alpha)
         else:
-            alpha_in = (1, 1, 1, 1)
-        alpha_out = mix_rgb(
+            alpha_in = 1.0
+        inp.alpha = mix_value(
             node_tree=node_tree,
             fac=is_super_bowl,
             a=inp.alpha,
             b=alpha_in,
         )
-        specular_out = mix_rgb(
-            node_tree=node_tree,
-            fac=is_super_bowl,
-            a=inp.specular,
-            b=(0, 0, 0, 0),
-        )
-        return PipelineType(
-            color=inp.color,
-            alpha=alpha_out,
-            sway_amp=inp.sway_amp,
-            specular=specular_out,
-        )
+        inp.specular = without_specular(fac=is_super_bowl, specular=inp.specular)
+        return inp
 
     # Reflection objects don't support untextured or specular textures.
     def tweak_reflection_objects(inp: PipelineType) -> PipelineType:
-        is_reflection_object = check_object_type(
-            node_tree, object_type_socket, RBRObjectType.REFLECTION_OBJECTS
-        )
+        is_reflection_object = object_types.check(RBRObjectType.REFLECTION_OBJECTS)
         if not render_type.has_diffuse_1():
-            color_out = mix_rgb(
+            inp.color = mix_rgb(
                 node_tree=node_tree,
                 fac=is_reflection_object,
                 a=inp.color,
-                b=BROKEN_COLOR,
+                b=const_color(BROKEN_COLOR),
             )
-            alpha_out = mix_rgb(
+            inp.alpha = mix_value(
                 node_tree=node_tree,
                 fac=is_reflection_object,
                 a=inp.alpha,
                 b=BROKEN_ALPHA,
             )
-        else:
-            color_out = inp.color
-            alpha_out = inp.alpha
-        specular_out = mix_rgb(
-            node_tree=node_tree,
-            fac=is_reflection_object,
-            a=inp.specular,
-            b=(0, 0, 0, 0),
-        )
-        return PipelineType(
-            color=color_out,
-            alpha=alpha_out,
-            sway_amp=inp.sway_amp,
-            specular=specular_out,
-        )
+        inp.specular = without_specular(fac=is_reflection_object, specular=inp.specular)
+        return inp
 
     # Water objects must be textured, but their specularity doesn't work.
     # Also, their UV animation only works if they have a specular texture.
     def tweak_water_objects(inp: PipelineType) -> PipelineType:
-        is_water_object = check_object_type(
-            node_tree, object_type_socket, RBRObjectType.WATER_OBJECTS
-        )
+        is_water_object = object_types.check(RBRObjectType.WATER_OBJECTS)
         if not render_type.has_diffuse_1():
-            color_out = mix_rgb(
+            inp.color = mix_rgb(
                 node_tree=node_tree,
                 fac=is_water_object,
                 a=inp.color,
-                b=BROKEN_COLOR,
+                b=const_color(BROKEN_COLOR),
             )
-            alpha_out = mix_rgb(
+            inp.alpha = mix_value(
                 node_tree=node_tree,
                 fac=is_water_object,
                 a=inp.alpha,
                 b=BROKEN_ALPHA,
             )
-        else:
-            color_out = inp.color
-            alpha_out = inp.alpha
-        specular_out = mix_rgb(
-            node_tree=node_tree,
-            fac=is_water_object,
-            a=inp.specular,
-            b=(0, 0, 0, 0),
-        )
-        return PipelineType(
-            color=color_out,
-            alpha=alpha_out,
-            sway_amp=inp.sway_amp,
-            specular=specular_out,
-        )
+        inp.specular = without_specular(fac=is_water_object, specular=inp.specular)
+        return inp
 
     # Interactive objects don't have alpha, untextured, or specular support,
     # and the single texture case clips at 80% opacity
     def tweak_interactive_objects(inp: PipelineType) -> PipelineType:
-        is_interactive_object = check_object_type(
-            node_tree, object_type_socket, RBRObjectType.INTERACTIVE_OBJECTS
-        )
-        color_in = None
+        is_interactive_object = object_types.check(RBRObjectType.INTERACTIVE_OBJECTS)
         if not render_type.has_diffuse_1():
-            color_in = BROKEN_COLOR
-            alpha_in = BROKEN_ALPHA
-        elif render_type.has_diffuse_2():
-            alpha_in = (1, 1, 1, 1)
-        else:
-            alpha_in = clip(inp.alpha)
-        if color_in is not None:
-            color_out = mix_rgb(
+            inp.color = mix_rgb(
                 node_tree=node_tree,
                 fac=is_interactive_object,
                 a=inp.color,
-                b=color_in,
+                b=const_color(BROKEN_COLOR),
             )
+            alpha_in = BROKEN_ALPHA
+        elif render_type.has_diffuse_2():
+            alpha_in = 1.0
         else:
-            color_out = inp.color
-        alpha_out = mix_rgb(
+            alpha_in = clip(inp.alpha)
+        inp.alpha = mix_value(
             node_tree=node_tree,
             fac=is_interactive_object,
             a=inp.alpha,
             b=alpha_in,
         )
-        specular_out = mix_rgb(
-            node_tree=node_tree,
-            fac=is_interactive_object,
-            a=inp.specular,
-            b=(0, 0, 0, 0),
-        )
-        return PipelineType(
-            color=color_out,
-            alpha=alpha_out,
-            sway_amp=inp.sway_amp,
-            specular=specular_out,
+        inp.specular = without_specular(
+            fac=is_interactive_object, specular=inp.specular
         )
-
-    pipeline_result = fold_compose(
-        [
-            tweak_geom_blocks,
-            tweak_object_blocks,
-            tweak_super_bowl,
-            tweak_reflection_objects,
-            tweak_water_objects,
-            tweak_interactive_objects,
+        return inp
+
+    # Leave out the tweaks which would pass everything through unchanged for
+    # this render type, along with their object type comparisons.
+    textured = render_type.has_diffuse_1()
+    textured_without_specular = textured and not render_type.has_specular()
+    tweaks = [
+        tweak
+        for (tweak, changes_outputs) in [
+            (tweak_geom_blocks, textured),
+            (tweak_object_blocks, True),
+            (tweak_super_bowl, True),
+            (tweak_reflection_objects, not textured_without_specular),
+            (tweak_water_objects, not textured_without_specular),
+            (tweak_interactive_objects, True),
         ]
-    )(
-        PipelineType(
-            color=diffuse, alpha=alpha, sway_amp=sway_amp, specular=(1, 1, 1, 1)
-        )
+        if changes_outputs
+    ]
+    pipeline_result = fold_compose(tweaks)(
+        PipelineType(color=diffuse, alpha=alpha, sway_amp=sway_amp, specular=1.0)
     )
 
     # Add the scattering
@@ -543,37 +623,29 @@ def make_bsdf(
     )
 
     # Fog
-    is_superbowl = check_object_type(
-        node_tree, object_type_socket, RBRObjectType.SUPER_BOWL
-    )
-    is_not_superbowl = make_math_node(node_tree, "SUBTRACT", in1=1.0, in2=is_superbowl)
-    other_fog_start = make_value(node_tree, sky.SKY_FOG_START)
-    other_fog_start = make_math_node(
-        node_tree, "MULTIPLY", in1=other_fog_start, in2=is_not_superbowl
-    )
-    superbowl_fog_start = make_value(node_tree, sky.SKY_SUPERBOWL_FOG_START)
-    superbowl_fog_start = make_math_node(
-        node_tree, "MULTIPLY", in1=superbowl_fog_start, in2=is_superbowl
-    )
-    fog_start = make_math_node(
-        node_tree, "ADD", in1=superbowl_fog_start, in2=other_fog_start
-    )
-    other_fog_end = make_value(node_tree, sky.SKY_FOG_END)
-    other_fog_end = make_math_node(
-        node_tree, "MULTIPLY", in1=other_fog_end, in2=is_not_superbowl
-    )
-    superbowl_fog_end = make_value(node_tree, sky.SKY_SUPERBOWL_FOG_END)
-    superbowl_fog_end = make_math_node(
-        node_tree, "MULTIPLY", in1=superbowl_fog_end, in2=is_superbowl
+    is_superbowl = object_types.check(RBRObjectType.SUPER_BOWL)
+    fog_start = mix_value(
+        node_tree,
+        fac=is_superbowl,
+        a=make_value(node_tree, sky.SKY_FOG_START),
+        b=make_value(node_tree, sky.SKY_SUPERBOWL_FOG_START),
     )
-    fog_end = make_math_node(node_tree, "ADD", in1=superbowl_fog_end, in2=other_fog_end)
-    camera_data = node_tree.nodes.new("ShaderNodeCameraData")
-    depth = camera_data.outputs["View Distance"]
-    fog_numerator = make_math_node(node_tree, "SUBTRACT", in1=fog_end, in2=depth)
-    fog_denominator = make_math_node(node_tree, "SUBTRACT", in1=fog_end, in2=fog_start)
-    fog_calc = make_math_node(
-        node_tree, "DIVIDE", in1=fog_numerator, in2=fog_denominator
+    fog_end = mix_value(
+        node_tree,
+        fac=is_superbowl,
+        a=make_value(node_tree, sky.SKY_FOG_END),
+        b=make_value(node_tree, sky.SKY_SUPERBOWL_FOG_END),
     )
+    # (fog_end - depth) / (fog_end - fog_start), clamped since the colour mix
+    # clamps its factor anyway.
+    fog_range = node_tree.nodes.new("ShaderNodeMapRange")
+    fog_range.clamp = True
+    node_tree.links.new(fog_range.inputs["Value"], camera_data.outputs["View Distance"])
+    node_tree.links.new(fog_range.inputs["From Min"], fog_start)
+    node_tree.links.new(fog_range.inputs["From Max"], fog_end)
+    fog_range.inputs["To Min"].default_value = 1.0
+    fog_range.inputs["To Max"].default_value = 0.0
+    fog_calc = fog_range.outputs["Result"]
     use_fog = make_value(node_tree, sky.SKY_USE_FOG)
     inv_fog = make_math_node(node_tree, "SUBTRACT", in1=1.0, in2=use_fog)
     fog_mix = make_math_node(node_tree, "MAXIMUM", in1=fog_calc, in2=inv_fog)
@@ -583,55 +655,18 @@ def make_bsdf(
     # Back to linear now we've done all of the (bad) sRGB multiplications.
     linear_color = srgb_to_linear(node_tree, result)
 
-    # Compute displacement
-    # It's really slow (when playing the timeline) so we disable it by default.
-    # Note that disabling this after enabling it may still be laggy until the
-    # material shader node is modified.
-    if flags.realtime_displacement:
-        time = node_tree.nodes.new("ShaderNodeTime").outputs["Time"]
-    else:
-        time = node_tree.nodes.new("ShaderNodeValue").outputs[0]
-    disp_pre_sin = make_math_node(
-        node_tree,
-        "MULTIPLY_ADD",
-        sway_freq,
-        time,
-        sway_phase,
-    )
-    disp_sin = make_math_node(
-        node_tree,
-        "SINE",
-        disp_pre_sin,
-    )
-    sway_displacement_value = make_math_node(
-        node_tree,
-        "MULTIPLY",
-        disp_sin,
-        pipeline_result.sway_amp,
-    )
-    # There is a wind strength coefficient hardcoded to 0.15.
-    sway_displacement_coeff = make_math_node(
-        node_tree,
-        "MULTIPLY",
-        sway_displacement_value,
-        # I don't know why we need this to be half the expected value.
-        # Maybe the 'sin' implementation is bad.
-        0.15 * 0.5,
-    )
-    # RBR only sways in X direction, it's hardcoded in the vertex shader.
-    sway_displacement_node = node_tree.nodes.new("ShaderNodeCombineXYZ")
-    node_tree.links.new(
-        sway_displacement_node.inputs["X"],
-        sway_displacement_coeff,
+    sway_displacement = make_sway_displacement(
+        node_tree=node_tree,
+        flags=flags,
+        sway_freq=sway_freq,
+        sway_amp=pipeline_result.sway_amp,
+        sway_phase=sway_phase,
     )
-    sway_displacement = sway_displacement_node.outputs["Vector"]
 
     if render_type.has_specular():
         # This implements SpecularVSFragment.hlsl and the use of it in
         # RLDoubleTextureSpecular.hlsl
-        geometry = node_tree.nodes.new("ShaderNodeNewGeometry")
-        # TODO does this point the right way?
-        view_vector = sky.flip_handedness(node_tree, geometry.outputs["Incoming"])
+        # TODO does view_vector point the right way?
         normal = geometry.outputs["Normal"]
 
         add_half = node_tree.nodes.new("ShaderNodeVectorMath")
@@ -655,8 +690,14 @@ def make_bsdf(
         subtract_beckmann = make_math_node(node_tree, "SUBTRACT", in1=1.0, in2=r1)
         beckmann_glossiness = sky.make_value(node_tree, sky.SKY_SPECULAR_GLOSSINESS)
         beckmann_alpha = sky.make_value(node_tree, sky.SKY_SPECULAR_ALPHA)
+        # The final factor of 4 is folded into the exponent, as
+        # 4 * 2^x = 2^(x + 2)
         mul_gloss = make_math_node(
-            node_tree, "MULTIPLY", in1=subtract_beckmann, in2=beckmann_glossiness
+            node_tree,
+            "MULTIPLY_ADD",
+            in1=subtract_beckmann,
+            in2=beckmann_glossiness,
+            in3=2.0,
         )
         gloss_pow = make_math_node(node_tree, "POWER", in1=2.0, in2=mul_gloss)
         gloss_pow_2 = make_math_node(node_tree, "MULTIPLY", in1=gloss_pow, in2=r1)
@@ -667,11 +708,8 @@ def make_bsdf(
         mul_strength = make_math_node(
             node_tree, "MULTIPLY", in1=mul_alpha, in2=vcol_spec
         )
-        mul_strength_4 = make_math_node(
-            node_tree, "MULTIPLY", in1=mul_strength, in2=4.0
-        )
         mul_bad = make_math_node(
-            node_tree, "MULTIPLY", in1=mul_strength_4, in2=pipeline_result.specular
+            node_tree, "MULTIPLY", in1=mul_strength, in2=pipeline_result.specular
         )
         specular_out = mix_rgb(
             node_tree=node_tree,
@@ -698,14 +736,7 @@ def make_bsdf(
             alpha=pipeline_result.alpha,
         )
 
-    return (
-        wrap_with_debug_shader(
-            color_socket=vcol,
-            alpha_socket=vcol_alpha,
-            other_shader_socket=output,
-        ),
-        sway_displacement,
-    )
+    return (output, sway_displacement)
 
 
 def make_alpha_shader(
@@ -746,6 +777,23 @@ def render_type_to_shader_name(render_type: RenderType) -> str:
     return sky.SHADER_PREFIX + render_type.name.title().replace("_", "")
 
 
+# Render types keyed by the name of their shader tree
+SHADER_NAME_RENDER_TYPES: Dict[str, RenderType] = {
+    render_type_to_shader_name(render_type): render_type for render_type in RenderType
+}
+
+
+def shader_name_to_render_type(name: str) -> Optional[RenderType]:
+    render_type = SHADER_NAME_RENDER_TYPES.get(name)
+    if render_type is None:
+        # Deal with duplicates (due to libraries) with names like
+        # .ShaderNodeRBR.DoubleTexture.001
+        (base_name, dot, _suffix) = name.rpartition(".")
+        if dot:
+            render_type = SHADER_NAME_RENDER_TYPES.get(base_name)
+    return render_type
+
+
 def use_bsdf_node_tree(
     context: bpy.types.Context, render_type: RenderType
 ) -> bpy.types.NodeTree:
@@ -756,23 +804,45 @@ def use_bsdf_node_tree(
     return node_tree
 
 
-def recreate_internals(context: bpy.types.Context) -> None:
+# ID property holding the shader flags each RBR shader tree was built with
+SHADER_BUILD_KEY_PROPERTY: str = "rbr_shader_build_key"
+
+
+def shader_build_key(flags: RBRGlobalShaderFlags) -> str:
+    """Everything besides the render type which changes the built tree"""
+    return (
+        f"{flags.realtime_displacement:d}"
+        + f"{flags.only_display_color:d}"
+        + f"{flags.only_display_alpha:d}"
+    )
+
+
+def recreate_internals(
+    context: bpy.types.Context,
+    only_changed: bool = False,
+) -> None:
+    """Rebuild the RBR shader trees. With only_changed, trees which were built
+    with the current shader flags are left alone."""
+    build_key = shader_build_key(context.scene.rbr_global_shader_flags)
+    # The shared sway tree is rebuilt first, the RBR trees below relink to it.
+    # It doesn't depend on the flags, and rebuilding it would unlink the trees
+    # we skip.
+    if not only_changed:
+        existing_sway_tree = bpy.data.node_groups.get(SWAY_NODE_TREE_NAME)
+        if existing_sway_tree is not None:
+            setup_sway_node_tree(existing_sway_tree)
     # Update the _trees_
     for node_tree in bpy.data.node_groups:
         if not node_tree.name.startswith(sky.SHADER_PREFIX):
             continue
-        for render_type in RenderType:
-            # Deal with matches
-            if node_tree.name == render_type_to_shader_name(render_type):
-                break
-            # Deal with duplicates (due to libraries) with names like
-            # .ShaderNodeRBR.DoubleTexture.001
-            if node_tree.name.startswith(render_type_to_shader_name(render_type) + "."):
-                break
-        else:
+        render_type = shader_name_to_render_type(node_tree.name)
+        if render_type is None:
+            continue
+        if only_changed and node_tree.get(SHADER_BUILD_KEY_PROPERTY) == build_key:
             continue
         node_tree.links.clear()
-        for node in node_tree.nodes:
+        # Take a copy, removing nodes while iterating the collection skips some
+        for node in list(node_tree.nodes):
             if isinstance(node, bpy.types.NodeGroupInput):
                 continue
             if isinstance(node, bpy.types.NodeGroupOutput):
@@ -805,6 +875,8 @@ def create_bsdf_node_tree(
         render_type_to_shader_name(render_type),
         "ShaderNodeTree",
     )
+    # The new tree holds sky values too
+    sky.invalidate_sky_trees()
     node_tree.nodes.new("NodeGroupInput")
     node_tree.nodes.new("NodeGroupOutput")
     create_sockets(node_tree, render_type)
@@ -817,115 +889,65 @@ def create_bsdf_node_tree(
     return node_tree
 
 
+class InputSocket(NamedTuple):
+    """An input socket of the RBR shader group"""
+
+    name: str
+    node_type: str
+    hide_value: bool
+    min: Optional[float] = None
+    max: Optional[float] = None
+
+
+DIFFUSE_1_INPUT_SOCKETS: Tuple[InputSocket, ...] = (
+    InputSocket(RBR_DIFFUSE_1_TEXTURE_INPUT, "NodeSocketColor", True),
+    InputSocket(RBR_DIFFUSE_1_ALPHA_INPUT, "NodeSocketFloat", True),
+)
+DIFFUSE_2_INPUT_SOCKETS: Tuple[InputSocket, ...] = (
+    InputSocket(RBR_DIFFUSE_2_TEXTURE_INPUT, "NodeSocketColor", True),
+    InputSocket(RBR_DIFFUSE_2_ALPHA_INPUT, "NodeSocketFloat", True),
+)
+SPECULAR_INPUT_SOCKETS: Tuple[InputSocket, ...] = (
+    InputSocket(RBR_SPECULAR_TEXTURE_INPUT, "NodeSocketColor", True),
+    InputSocket(RBR_SPECULAR_STRENGTH_INPUT_NAME, "NodeSocketFloat", False, 0.0, 1.0),
+)
+COMMON_INPUT_SOCKETS: Tuple[InputSocket, ...] = (
+    InputSocket(RBR_COLOR_INPUT_NAME, "NodeSocketColor", True),
+    InputSocket(RBR_ALPHA_INPUT_NAME, "NodeSocketFloat", True),
+    InputSocket(
+        RBR_SWAY_FREQ_INPUT_NAME, "NodeSocketFloat", False, -math.inf, math.inf
+    ),
+    InputSocket(RBR_SWAY_AMP_INPUT_NAME, "NodeSocketFloat", False, -math.inf, math.inf),
+    InputSocket(
+        RBR_SWAY_PHASE_INPUT_NAME, "NodeSocketFloat", False, -math.inf, math.inf
+    ),
+)
+
+
 def create_sockets(
     node_tree: bpy.types.NodeTree,
     render_type: RenderType,
 ) -> None:
-    def add_input_socket(
-        name: str,
-        node_type: str,
-        hide_value: bool,
-        min: Optional[float] = None,
-        max: Optional[float] = None,
-    ) -> None:
-        socket = node_tree.interface.new_socket(
-            name, in_out="INPUT", socket_type=node_type
-        )
-        if min is not None:
-            socket.min_value = min
-        if max is not None:
-            socket.max_value = max
-        socket.hide_value = hide_value
-
+    input_sockets: List[InputSocket] = []
     if render_type.has_diffuse_1():
-        add_input_socket(
-            name=RBR_DIFFUSE_1_TEXTURE_INPUT,
-            node_type="NodeSocketColor",
-            hide_value=True,
-        )
-        add_input_socket(
-            name=RBR_DIFFUSE_1_ALPHA_INPUT,
-            node_type="NodeSocketFloat",
-            hide_value=True,
-        )
+        input_sockets.extend(DIFFUSE_1_INPUT_SOCKETS)
         if render_type.has_diffuse_2():
-            add_input_socket(
-                name=RBR_DIFFUSE_2_TEXTURE_INPUT,
-                node_type="NodeSocketColor",
-                hide_value=True,
-            )
-            add_input_socket(
-                name=RBR_DIFFUSE_2_ALPHA_INPUT,
-                node_type="NodeSocketFloat",
-                hide_value=True,
-            )
+            input_sockets.extend(DIFFUSE_2_INPUT_SOCKETS)
         if render_type.has_specular():
-            add_input_socket(
-                name=RBR_SPECULAR_TEXTURE_INPUT,
-                node_type="NodeSocketColor",
-                hide_value=True,
-            )
-            add_input_socket(
-                name=RBR_SPECULAR_STRENGTH_INPUT_NAME,
-                node_type="NodeSocketFloat",
-                hide_value=False,
-                min=0.0,
-                max=1.0,
-            )
-    add_input_socket(
-        name=RBR_COLOR_INPUT_NAME,
-        node_type="NodeSocketColor",
-        hide_value=True,
-    )
-    add_input_socket(
-        name=RBR_ALPHA_INPUT_NAME,
-        node_type="NodeSocketFloat",
-        hide_value=True,
-    )
-    add_input_socket(
-        name=RBR_SWAY_FREQ_INPUT_NAME,
-        node_type="NodeSocketFloat",
-        hide_value=False,
-        min=-math.inf,
-        max=math.inf,
-    )
-    add_input_socket(
-        name=RBR_SWAY_AMP_INPUT_NAME,
-        node_type="NodeSocketFloat",
-        hide_value=False,
-        min=-math.inf,
-        max=math.inf,
-    )
-    add_input_socket(
-        name=RBR_SWAY_PHASE_INPUT_NAME,
-        node_type="NodeSocketFloat",
-        hide_value=False,
-        min=-math.inf,
-        max=math.inf,
-    )
+            input_sockets.extend(SPECULAR_INPUT_SOCKETS)
+    input_sockets.extend(COMMON_INPUT_SOCKETS)
 
-    def add_output_socket(
-        name: str,
-        node_type: str,
-        min: Optional[float] = None,
-        max: Optional[float] = None,
-    ) -> None:
-        socket = node_tree.interface.new_socket(
-            name, in_out="OUTPUT", socket_type=node_type
-        )
-        if min is not None:
-            socket.min_value = min
-        if max is not None:
-            socket.max_value = max
-
-    add_output_socket(
-        name="Surface",
-        node_type="NodeSocketShader",
-    )
-    add_output_socket(
-        name="Displacement",
-        node_type="NodeSocketVector",
-    )
+    new_socket = node_tree.interface.new_socket
+    for spec in input_sockets:
+        socket = new_socket(spec.name, in_out="INPUT", socket_type=spec.node_type)
+        if spec.min is not None:
+            socket.min_value = spec.min
+        if spec.max is not None:
+            socket.max_value = spec.max
+        socket.hide_value = spec.hide_value
+
+    new_socket("Surface", in_out="OUTPUT", socket_type="NodeSocketShader")
+    new_socket("Displacement", in_out="OUTPUT", socket_type="NodeSocketVector")
 
 
 def make_nodes_and_links(
@@ -933,9 +955,11 @@ def make_nodes_and_links(
     node_tree: bpy.types.NodeTree,
     render_type: RenderType,
 ) -> None:
+    flags: RBRGlobalShaderFlags = context.scene.rbr_global_shader_flags
     (surface, displacement) = make_bsdf(
         node_tree=node_tree,
         render_type=render_type,
+        flags=flags,
     )
     node_tree.links.new(
         node_tree.nodes["Group Output"].inputs["Surface"],
@@ -945,17 +969,24 @@ def make_nodes_and_links(
         node_tree.nodes["Group Output"].inputs["Displacement"],
         displacement,
     )
+    node_tree[SHADER_BUILD_KEY_PROPERTY] = shader_build_key(flags)
+
+
+# The texture, UV map and UV velocity found by walking back from an input of
+# the RBR shader node
+TextureWalk = Tuple[Optional[str], Optional[SomeUVMap], Optional[Vector2]]
 
 
 def reify_uv_map(
     node: bpy.types.Node,
     socket: bpy.types.NodeSocket,
 ) -> Optional[SomeUVMap]:
-    if isinstance(socket, bpy.types.NodeSocketVector) and isinstance(
-        node, bpy.types.ShaderNodeAttribute
-    ):
+    # Compare the type enums, a plain attribute read, rather than walking the
+    # class hierarchy with isinstance.
+    node_type = node.type
+    if node_type == "ATTRIBUTE" and socket.type == "VECTOR":
         return UVMapAttr(node.attribute_name)
-    elif isinstance(node, bpy.types.ShaderNodeUVMap):
+    elif node_type == "UVMAP":
         return UVMap(node.uv_map)
     else:
         return None
@@ -990,51 +1021,71 @@ class ShaderNodeRBR(bpy.types.ShaderNodeCustomGroup):
         # texture inputs to value/color inputs, so we remove them before
         # switching trees.
         parent_tree = self.id_data
+        links = parent_tree.links
         input_links = []
         output_links = []
-        for link in parent_tree.links:
+        # Record everything first, so the links collection isn't modified
+        # while we walk it.
+        to_remove = []
+        for link in links:
             if link.to_node == self:
                 input_links.append((link.to_socket.name, link.from_socket))
             elif link.from_node == self:
                 output_links.append((link.from_socket.name, link.to_socket))
             else:
                 continue
-            parent_tree.links.remove(link)
+            to_remove.append(link)
+        remove_link = links.remove
+        for link in to_remove:
+            remove_link(link)
         self.node_tree = use_bsdf_node_tree(context, render_type)
         # This can overwrite user settings, but that seems fine. The node tree switch
         # will cause them to revert back to 0, which makes the object invisible and
         # black, which can be confusing for users. It's better to force it back to white.
-        self.inputs[RBR_COLOR_INPUT_NAME].default_value = [1, 1, 1, 1]
-        self.inputs[RBR_ALPHA_INPUT_NAME].default_value = 1
+        inputs_by_name = {socket.name: socket for socket in self.inputs}
+        # Only write values which differ, every write tags the material for
+        # an update.
+        color_input = inputs_by_name[RBR_COLOR_INPUT_NAME]
+        if tuple(color_input.default_value) != (1, 1, 1, 1):
+            color_input.default_value = [1, 1, 1, 1]
+        alpha_input = inputs_by_name[RBR_ALPHA_INPUT_NAME]
+        if alpha_input.default_value != 1:
+            alpha_input.default_value = 1
+        new_link = links.new
         for socket_name, from_socket in input_links:
-            try:
-                parent_tree.links.new(
-                    self.inputs[socket_name],
-                    from_socket,
-                )
-            except KeyError:
-                # The input might have been removed.
-                pass
+            input_socket = inputs_by_name.get(socket_name)
+            # The input might have been removed.
+            if input_socket is not None:
+                new_link(input_socket, from_socket)
+        outputs_by_name = {socket.name: socket for socket in self.outputs}
         for socket_name, to_socket in output_links:
             # This changed between addon versions. This special case is for convenience.
             if socket_name == "Shader":
                 socket_name = "Surface"
-            parent_tree.links.new(
-                self.outputs[socket_name],
-                to_socket,
-            )
+            new_link(outputs_by_name[socket_name], to_socket)
+
+    def update_render_type(self, context: bpy.types.Context) -> None:
+        # Some toggles don't change the render type (e.g. specular without a
+        # diffuse texture), so keep the tree and links as they are.
+        if (
+            self.node_tree is not None
+            and shader_name_to_render_type(self.node_tree.name)
+            == self.calculate_render_type()
+        ):
+            return
+        self.select_node_tree(context)
 
     has_diffuse_1: bpy.props.BoolProperty(  # type: ignore
         name="Diffuse Texture 1",
-        update=lambda self, context: self.select_node_tree(context),
+        update=lambda self, context: self.update_render_type(context),
     )
     has_diffuse_2: bpy.props.BoolProperty(  # type: ignore
         name="Diffuse Texture 2",
-        update=lambda self, context: self.select_node_tree(context),
+        update=lambda self, context: self.update_render_type(context),
     )
     has_specular: bpy.props.BoolProperty(  # type: ignore
         name="Specular Texture",
-        update=lambda self, context: self.select_node_tree(context),
+        update=lambda self, context: self.update_render_type(context),
     )
 
     # TODO WARNING All of these properties are due to be removed
@@ -1074,7 +1125,17 @@ class ShaderNodeRBR(bpy.types.ShaderNodeCustomGroup):
         self,
         material: bpy.types.Material,
         input_name: str,
-    ) -> Tuple[Optional[str], Optional[SomeUVMap], Optional[Vector2]]:
+    ) -> TextureWalk:
+        return self.walk_to_textures(material, [input_name])[0]
+
+    def walk_to_textures(
+        self,
+        material: bpy.types.Material,
+        input_names: List[str],
+    ) -> List[TextureWalk]:
+        """Walk to the textures of several inputs, in order, going over the
+        links of the material only once.
+        """
         if not material.use_nodes:
             raise errors.E0138(material_name=material.name)
         node_tree = material.node_tree
@@ -1082,23 +1143,34 @@ class ShaderNodeRBR(bpy.types.ShaderNodeCustomGroup):
             raise errors.RBRAddonBug(
                 f"Shader node is not in material {material.name}, this is an addon bug"
             )
-        if input_name not in self.inputs:
+        # Index the links by the socket they go to, so each step of the walk
+        # is a lookup rather than another scan over every link in the tree.
+        incoming = {link.to_socket.as_pointer(): link for link in node_tree.links}
+        return [
+            self.walk_links_to_texture(material, incoming, input_name)
+            for input_name in input_names
+        ]
+
+    def walk_links_to_texture(
+        self,
+        material: bpy.types.Material,
+        incoming: Dict[int, bpy.types.NodeLink],
+        input_name: str,
+    ) -> TextureWalk:
+        input_socket = self.inputs.get(input_name)
+        if input_socket is None:
             return (None, None, None)
-        for link in node_tree.links:
-            if link.to_socket == self.inputs[input_name]:
-                texture_node = link.from_node
-                break
-        else:
+        link = incoming.get(input_socket.as_pointer())
+        if link is None:
             raise errors.E0139(material_name=material.name, input_name=input_name)
+        texture_node = link.from_node
         if not isinstance(texture_node, ShaderNodeRBRTexture):
             raise errors.E0140(material_name=material.name, input_name=input_name)
-        for link in node_tree.links:
-            if link.to_socket == texture_node.inputs["UV"]:
-                uv_node = link.from_node
-                uv_from_socket = link.from_socket
-                break
-        else:
+        link = incoming.get(texture_node.inputs["UV"].as_pointer())
+        if link is None:
             raise errors.E0141(material_name=material.name)
+        uv_node = link.from_node
+        uv_from_socket = link.from_socket
 
         # Check for UV node or attr node directly connected
         uv_map = reify_uv_map(uv_node, uv_from_socket)
@@ -1107,21 +1179,17 @@ class ShaderNodeRBR(bpy.types.ShaderNodeCustomGroup):
         # Check for velocity node and then UV node
         if not isinstance(uv_node, ShaderNodeUVVelocity):
             raise errors.E0142(material_name=material.name)
-        for link in node_tree.links:
-            if link.to_socket == uv_node.inputs["UV Velocity"]:
-                raise errors.E0143(material_name=material.name)
+        uv_velocity_socket = uv_node.inputs["UV Velocity"]
+        if uv_velocity_socket.as_pointer() in incoming:
+            raise errors.E0143(material_name=material.name)
         uv_velocity = Vector2(
-            x=uv_node.inputs["UV Velocity"].default_value[0],
-            y=-uv_node.inputs["UV Velocity"].default_value[1],
+            x=uv_velocity_socket.default_value[0],
+            y=-uv_velocity_socket.default_value[1],
         )
-        for link in node_tree.links:
-            if link.to_socket == uv_node.inputs["UV"]:
-                uv_map_node = link.from_node
-                uv_map_from_socket = link.from_socket
-                break
-        else:
+        link = incoming.get(uv_node.inputs["UV"].as_pointer())
+        if link is None:
             raise errors.E0144(material_name=material.name)
-        uv_map = reify_uv_map(uv_map_node, uv_map_from_socket)
+        uv_map = reify_uv_map(link.from_node, link.from_socket)
         if uv_map is not None:
             return (texture_node.texture_name_filename(), uv_map, uv_velocity)
         else:
@@ -1133,19 +1201,11 @@ def material_name(
     diffuse_2: Optional[bpy.types.NodeTree],
     specular: Optional[bpy.types.NodeTree],
 ) -> str:
-    def get_name(tree: Optional[bpy.types.NodeTree]) -> str:
-        if tree is None:
-            return ""
-        name = tree_name_to_texture_name(tree)
-        if name is None:
-            return ""
-        return name
-
-    diffuse_1_name = get_name(diffuse_1)
-    diffuse_2_name = get_name(diffuse_2)
-    specular_name = get_name(specular)
-    parts = [diffuse_1_name, diffuse_2_name, specular_name]
-    return "_".join(filter(lambda x: x != "", parts))
+    names = (
+        tree_name_to_texture_name(tree) if tree is not None else None
+        for tree in (diffuse_1, diffuse_2, specular)
+    )
+    return "_".join(name for name in names if name)
 
 
 def create_texture_and_uv(
@@ -1155,40 +1215,67 @@ def create_texture_and_uv(
     color: bpy.types.NodeSocketColor,
     alpha: Optional[bpy.types.NodeSocketFloat],
     uv_velocity: List[float],  # FloatVectorProperty
+    uv_sockets: Dict[Tuple[str, float, float], bpy.types.NodeSocket],
 ) -> None:
-    tex_node = node_tree.nodes.new("ShaderNodeRBRTexture")
+    """Create a texture node and the UV nodes feeding it. UV outputs are
+    recorded in uv_sockets, so textures in the same material with the same
+    UV layer and velocity share them.
+    """
+    new_link = node_tree.links.new
+    new_node = node_tree.nodes.new
+    tex_node = new_node("ShaderNodeRBRTexture")
     tex_node.node_tree = tex_tree
-    node_tree.links.new(
+    new_link(
         tex_node.outputs[RBR_TEXTURE_COLOR_OUTPUT],
         color,
     )
     if alpha is not None:
-        node_tree.links.new(
+        new_link(
             tex_node.outputs[RBR_TEXTURE_ALPHA_OUTPUT],
             alpha,
         )
-    uv_node = node_tree.nodes.new("ShaderNodeUVMap")
-    uv_node.uv_map = uv_layer
-    if uv_velocity[0] == 0 and uv_velocity[1] == 0:
-        node_tree.links.new(
-            tex_node.inputs["UV"],
-            uv_node.outputs["UV"],
-        )
-    else:
-        uv_velocity_node = node_tree.nodes.new("ShaderNodeUVVelocity")
-        uv_velocity_node.inputs["UV Velocity"].default_value = [
-            uv_velocity[0],
-            uv_velocity[1],
-            0,
-        ]
-        node_tree.links.new(
-            uv_velocity_node.inputs["UV"],
-            uv_node.outputs["UV"],
-        )
-        node_tree.links.new(
-            tex_node.inputs["UV"],
-            uv_velocity_node.outputs["UV"],
-        )
+    uv_key = (uv_layer, uv_velocity[0], uv_velocity[1])
+    uv_socket = uv_sockets.get(uv_key)
+    if uv_socket is None:
+        uv_node = new_node("ShaderNodeUVMap")
+        uv_node.uv_map = uv_layer
+        uv_socket = uv_node.outputs["UV"]
+        if uv_velocity[0] != 0 or uv_velocity[1] != 0:
+            uv_velocity_node = new_node("ShaderNodeUVVelocity")
+            uv_velocity_node.inputs["UV Velocity"].default_value = [
+                uv_velocity[0],
+                uv_velocity[1],
+                0,
+            ]
+            new_link(
+                uv_velocity_node.inputs["UV"],
+                uv_socket,
+            )
+            uv_socket = uv_velocity_node.outputs["UV"]
+        uv_sockets[uv_key] = uv_socket
+    new_link(
+        tex_node.inputs["UV"],
+        uv_socket,
+    )
+
+
+# Names of materials made by make_rbr_blender_material, keyed by the names of
+# the texture trees they were made from. Pointers aren't used, since a new tree
+# can reuse the address of a removed one. Only names are kept, since holding on
+# to blender data can crash once it goes stale.
+material_name_cache: Dict[Tuple[Optional[str], ...], str] = dict()
+
+
+@bpy.app.handlers.persistent  # type: ignore
+def invalidate_material_name_cache(*args: Any) -> None:
+    material_name_cache.clear()
+
+
+material_name_cache_handlers = [
+    bpy.app.handlers.load_post,
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+]
 
 
 def make_rbr_blender_material(
@@ -1198,6 +1285,14 @@ def make_rbr_blender_material(
     uv_velocity: Optional[UVVelocity],
     sway: bool = False,
 ) -> bpy.types.Material:
+    key = tuple(
+        None if tree is None else tree.name for tree in (diffuse_1, diffuse_2, specular)
+    )
+    cached_name = material_name_cache.get(key)
+    if cached_name is not None:
+        material = bpy.data.materials.get(cached_name)
+        if material is not None:
+            return material
     name = material_name(
         diffuse_1=diffuse_1,
         diffuse_2=diffuse_2,
@@ -1208,57 +1303,80 @@ def make_rbr_blender_material(
     # I'm choosing to ignore that.
     material = bpy.data.materials.get(name)
     if material is not None:
+        material_name_cache[key] = material.name
         return material
     material = bpy.data.materials.new(name=name)
+    material_name_cache[key] = material.name
     # For sway displacement
     material.cycles.displacement_method = "BOTH"
     material.use_nodes = True
     node_tree = material.node_tree
-    node_tree.links.clear()
-    node_tree.nodes.clear()
-    node_output_material = node_tree.nodes.new("ShaderNodeOutputMaterial")
-    node_rbr = node_tree.nodes.new(ShaderNodeRBR.bl_name)
+    new_link = node_tree.links.new
+    new_node = node_tree.nodes.new
+    # use_nodes fills in a default BSDF and output. Keep the output rather than
+    # clearing the tree and making a new one, removing the BSDF drops its link.
+    node_output_material = None
+    for node in list(node_tree.nodes):
+        if node_output_material is None and isinstance(
+            node, bpy.types.ShaderNodeOutputMaterial
+        ):
+            node_output_material = node
+        else:
+            node_tree.nodes.remove(node)
+    if node_output_material is None:
+        node_output_material = new_node("ShaderNodeOutputMaterial")
+    node_rbr = new_node(ShaderNodeRBR.bl_name)
+    # Settle the render type before linking anything. Each switch swaps the
+    # node tree and its sockets, so the inputs can then be looked up just once.
     if diffuse_1 is not None:
         node_rbr.has_diffuse_1 = True
+        if diffuse_2 is not None:
+            node_rbr.has_diffuse_2 = True
+        if specular is not None:
+            node_rbr.has_specular = True
+    inputs = node_rbr.inputs
+    uv_sockets: Dict[Tuple[str, float, float], bpy.types.NodeSocket] = dict()
+    if diffuse_1 is not None:
         create_texture_and_uv(
             node_tree=node_tree,
             tex_tree=diffuse_1,
             uv_layer=UV_DIFFUSE_1,
-            color=node_rbr.inputs[RBR_DIFFUSE_1_TEXTURE_INPUT],
-            alpha=node_rbr.inputs[RBR_DIFFUSE_1_ALPHA_INPUT],
+            color=inputs[RBR_DIFFUSE_1_TEXTURE_INPUT],
+            alpha=inputs[RBR_DIFFUSE_1_ALPHA_INPUT],
             uv_velocity=(
                 [0, 0]
                 if uv_velocity is None
                 else [uv_velocity.diffuse_1.x, -uv_velocity.diffuse_1.y]
             ),
+            uv_sockets=uv_sockets,
         )
         if diffuse_2 is not None:
-            node_rbr.has_diffuse_2 = True
             create_texture_and_uv(
                 node_tree=node_tree,
                 tex_tree=diffuse_2,
                 uv_layer=UV_DIFFUSE_2,
-                color=node_rbr.inputs[RBR_DIFFUSE_2_TEXTURE_INPUT],
-                alpha=node_rbr.inputs[RBR_DIFFUSE_2_ALPHA_INPUT],
+                color=inputs[RBR_DIFFUSE_2_TEXTURE_INPUT],
+                alpha=inputs[RBR_DIFFUSE_2_ALPHA_INPUT],
                 uv_velocity=(
                     [0, 0]
                     if uv_velocity is None
                     else [uv_velocity.diffuse_2.x, -uv_velocity.diffuse_2.y]
                 ),
+                uv_sockets=uv_sockets,
             )
         if specular is not None:
-            node_rbr.has_specular = True
             create_texture_and_uv(
                 node_tree=node_tree,
                 tex_tree=specular,
                 uv_layer=UV_SPECULAR,
-                color=node_rbr.inputs[RBR_SPECULAR_TEXTURE_INPUT],
+                color=inputs[RBR_SPECULAR_TEXTURE_INPUT],
                 alpha=None,
                 uv_velocity=(
                     [0, 0]
                     if uv_velocity is None
                     else [uv_velocity.specular.x, -uv_velocity.specular.y]
                 ),
+                uv_sockets=uv_sockets,
             )
 
     def make_vc(
@@ -1266,15 +1384,15 @@ def make_rbr_blender_material(
         color_out: Optional[bpy.types.NodeSocket] = None,
         alpha_out: Optional[bpy.types.NodeSocket] = None,
     ) -> bpy.types.NodeSocket:
-        node = node_tree.nodes.new("ShaderNodeVertexColor")
+        node = new_node("ShaderNodeVertexColor")
         node.layer_name = layer_name
         if color_out is not None:
-            node_tree.links.new(
+            new_link(
                 color_out,
                 node.outputs["Color"],
             )
         if alpha_out is not None:
-            node_tree.links.new(
+            new_link(
                 alpha_out,
                 node.outputs["Alpha"],
             )
@@ -1282,13 +1400,13 @@ def make_rbr_blender_material(
 
     make_vc(
         layer_name=VC_COLOR,
-        color_out=node_rbr.inputs[RBR_COLOR_INPUT_NAME],
-        alpha_out=node_rbr.inputs[RBR_ALPHA_INPUT_NAME],
+        color_out=inputs[RBR_COLOR_INPUT_NAME],
+        alpha_out=inputs[RBR_ALPHA_INPUT_NAME],
     )
     if specular is not None:
         make_vc(
             layer_name=VC_SPECULAR_STRENGTH,
-            color_out=node_rbr.inputs[RBR_SPECULAR_STRENGTH_INPUT_NAME],
+            color_out=inputs[RBR_SPECULAR_STRENGTH_INPUT_NAME],
         )
     if sway:
 
@@ -1305,8 +1423,8 @@ def make_rbr_blender_material(
                 ).outputs["Color"],
                 in2=multiplier,
             )
-            node_tree.links.new(
-                node_rbr.inputs[sway_input_name],
+            new_link(
+                inputs[sway_input_name],
                 mult,
             )
 
@@ -1326,11 +1444,11 @@ def make_rbr_blender_material(
             multiplier=2 * math.pi,
         )
 
-    node_tree.links.new(
+    new_link(
         node_output_material.inputs["Surface"],
         node_rbr.outputs["Surface"],
     )
-    node_tree.links.new(
+    new_link(
         node_output_material.inputs["Displacement"],
         node_rbr.outputs["Displacement"],
     )
@@ -1339,7 +1457,15 @@ def make_rbr_blender_material(
 
 def register() -> None:
     bpy.utils.register_class(ShaderNodeRBR)
+    for handlers in material_name_cache_handlers:
+        handlers.append(invalidate_material_name_cache)
 
 
 def unregister() -> None:
+    for handlers in material_name_cache_handlers:
+        try:
+            handlers.remove(invalidate_material_name_cache)
+        except ValueError:
+            pass
+    material_name_cache.clear()
     bpy.utils.unregister_class(ShaderNodeRBR)
@@ -2,7 +2,7 @@
 """
 
 import math
-from typing import Optional, Tuple
+from typing import Any, List, Optional, Tuple
 
 import bpy  # type: ignore
 from mathutils import Vector  # type: ignore
@@ -16,7 +16,6 @@ from .utils import (
     vector_math,
     vector_math_float,
     vector_multiply,
-    vector_power,
     vector_scale,
     vector_subtract,
 )
@@ -45,50 +44,128 @@ def compute_left_hand_sun_dir(
 
 
 def update_sun_dir() -> None:
-    for obj in bpy.context.scene.objects:
-        if not isinstance(obj.data, bpy.types.SunLight):
+    global last_sun_dir
+    scene = bpy.context.scene
+    tint_set = scene.rbr_track_settings.tint_set
+    for obj in scene.objects:
+        # Check the type enums first, they are cheap and rule out most objects
+        if obj.type != "LIGHT" or obj.data.type != "SUN":
             continue
         settings: RBRObjectSettings = obj.rbr_object_settings
-        if RBRObjectType[settings.type] is not RBRObjectType.SUN:
+        if settings.type != RBRObjectType.SUN.name:
             continue
-        if bpy.context.scene.rbr_track_settings.tint_set not in settings.tint_sets:
+        if tint_set not in settings.tint_sets:
             continue
-        sun_dir = compute_left_hand_sun_dir(obj)
-        update_sky_vector(SKY_SUN_DIR, sun_dir.to_tuple())
+        sun_dir = compute_left_hand_sun_dir(obj).to_tuple()
+        update_sky_vector(SKY_SUN_DIR, sun_dir)
+        # Keep the sun daemon's record in step with what the trees hold
+        last_sun_dir = sun_dir
         break
 
 
 SHADER_PREFIX: str = ".ShaderNodeRBR."
 
 
-def update_sky_value(node_name: str, value: float) -> None:
-    for node_group in bpy.data.node_groups:
-        if node_group.name == SKY_NODE_TREE_NAME or node_group.name.startswith(
-            SHADER_PREFIX
-        ):
-            node = node_group.nodes.get(node_name)
-            if node is not None:
-                node.outputs[0].default_value = value
+# Keys of the node groups which hold sky values, as (name, library filepath)
+# pairs. Built lazily, since the sun daemon updates them on every depsgraph
+# update. Keys rather than trees are kept, since holding on to blender data can
+# crash once it goes stale. Thrown away on load/undo/redo and whenever we make
+# such a tree, and rebuilt when node groups come or go behind our back (e.g.
+# appended or linked trees) or a key no longer resolves.
+sky_tree_keys: Optional[List[Tuple[str, Optional[str]]]] = None
+# The number of node groups when the keys were taken
+sky_tree_node_group_count: int = 0
 
 
-def update_sky_vector(node_name: str, value: Tuple[float, float, float]) -> None:
-    for node_group in bpy.data.node_groups:
-        if node_group.name == SKY_NODE_TREE_NAME or node_group.name.startswith(
-            SHADER_PREFIX
-        ):
-            node = node_group.nodes.get(node_name)
-            if node is not None:
-                node.inputs["X"].default_value = value[0]
-                node.inputs["Y"].default_value = value[1]
-                node.inputs["Z"].default_value = value[2]
+# The sun direction last written by the sun daemon. Cleared along with the
+# tree keys, so trees which are new or reloaded always get written.
+last_sun_dir: Optional[Tuple[float, float, float]] = None
+
+
+@bpy.app.handlers.persistent  # type: ignore
+def invalidate_sky_trees(*args: Any) -> None:
+    global sky_tree_keys, sky_tree_node_group_count, last_sun_dir
+    sky_tree_keys = None
+    sky_tree_node_group_count = 0
+    last_sun_dir = None
+
+
+# Clear before loading too, so load_post handlers which update sky values
+# never see keys from the previous file.
+sky_tree_handlers = [
+    bpy.app.handlers.load_pre,
+    bpy.app.handlers.load_post,
+    bpy.app.handlers.undo_post,
+    bpy.app.handlers.redo_post,
+]
+
+
+def scan_sky_tree_keys() -> None:
+    global sky_tree_keys, sky_tree_node_group_count, last_sun_dir
+    keys = [
+        (
+            node_group.name,
+            None if node_group.library is None else node_group.library.filepath,
+        )
+        for node_group in bpy.data.node_groups
+        if node_group.name == SKY_NODE_TREE_NAME
+        or node_group.name.startswith(SHADER_PREFIX)
+    ]
+    # Trees we haven't written to yet need the sun direction too
+    if keys != sky_tree_keys:
+        last_sun_dir = None
+    sky_tree_keys = keys
+    sky_tree_node_group_count = len(bpy.data.node_groups)
+
+
+def check_sky_tree_keys() -> None:
+    """Rescan the sky trees if node groups have been added or removed."""
+    if sky_tree_keys is None or len(bpy.data.node_groups) != sky_tree_node_group_count:
+        scan_sky_tree_keys()
+
+
+def sky_trees() -> List[bpy.types.NodeTree]:
+    """The sky node tree and the RBR shader trees"""
+    check_sky_tree_keys()
+    assert sky_tree_keys is not None
+    get_node_group = bpy.data.node_groups.get
+    node_groups = list(map(get_node_group, sky_tree_keys))
+    if None in node_groups:
+        # Trees were renamed or swapped out without changing the count
+        scan_sky_tree_keys()
+        node_groups = list(map(get_node_group, sky_tree_keys))
+    return [node_group for node_group in node_groups if node_group is not None]
 
 
-def make_wavelength(node_tree: bpy.types.NodeTree) -> bpy.types.NodeSocket:
-    wavelength = node_tree.nodes.new("ShaderNodeCombineXYZ")
-    wavelength.inputs["X"].default_value = 0.65
-    wavelength.inputs["Y"].default_value = 0.57
-    wavelength.inputs["Z"].default_value = 0.475
-    return wavelength.outputs[0]
+def update_sky_value(node_name: str, value: float) -> None:
+    for node_group in sky_trees():
+        node = node_group.nodes.get(node_name)
+        if node is not None:
+            node.outputs[0].default_value = value
+
+
+def update_sky_vector(node_name: str, value: Tuple[float, float, float]) -> None:
+    for node_group in sky_trees():
+        node = node_group.nodes.get(node_name)
+        if node is not None:
+            node.inputs["X"].default_value = value[0]
+            node.inputs["Y"].default_value = value[1]
+            node.inputs["Z"].default_value = value[2]
+
+
+WAVELENGTH: Tuple[float, float, float] = (0.65, 0.57, 0.475)
+# The wavelength is constant, so its powers are worked out here rather than
+# with a node per channel in every tree.
+WAVELENGTH_AEROSOL: Tuple[float, float, float] = (
+    WAVELENGTH[0] ** -1.3,
+    WAVELENGTH[1] ** -1.3,
+    WAVELENGTH[2] ** -1.3,
+)
+WAVELENGTH_RAYLEIGH: Tuple[float, float, float] = (
+    WAVELENGTH[0] ** -4.08,
+    WAVELENGTH[1] ** -4.08,
+    WAVELENGTH[2] ** -4.08,
+)
 
 
 def flip_handedness(
@@ -96,13 +173,14 @@ def flip_handedness(
     vector: bpy.types.NodeSocketVector,
 ) -> bpy.types.NodeSocketVector:
     """Flip handedness (XYZ to XZY)"""
-    separate = node_tree.nodes.new("ShaderNodeSeparateXYZ")
-    node_tree.links.new(vector, separate.inputs[0])
-    combine = node_tree.nodes.new("ShaderNodeCombineXYZ")
-    node_tree.links.new(separate.outputs["X"], combine.inputs["X"])
-    node_tree.links.new(separate.outputs["Y"], combine.inputs["Z"])
-    node_tree.links.new(separate.outputs["Z"], combine.inputs["Y"])
-    return combine.outputs[0]
+    # The swap is a reflection, which a single mapping node can do: negating Z
+    # and then turning a quarter about X takes (x, y, z) to (x, z, y).
+    mapping = node_tree.nodes.new("ShaderNodeMapping")
+    mapping.vector_type = "VECTOR"
+    mapping.inputs["Rotation"].default_value = (math.pi / 2, 0.0, 0.0)
+    mapping.inputs["Scale"].default_value = (1.0, 1.0, -1.0)
+    node_tree.links.new(vector, mapping.inputs["Vector"])
+    return mapping.outputs["Vector"]
 
 
 def setup_transmittance_nodes(
@@ -111,7 +189,6 @@ def setup_transmittance_nodes(
     sun_dir: bpy.types.NodeSocketVector,
     sun_offset: bpy.types.NodeSocketFloat,
 ) -> bpy.types.NodeSocketVector:
-    wavelength = make_wavelength(node_tree)
     # Compute Z (apparent solar zenith angle)
     sep_sun_dir = node_tree.nodes.new("ShaderNodeSeparateXYZ")
     node_tree.links.new(sun_dir, sep_sun_dir.inputs[0])
@@ -119,51 +196,68 @@ def setup_transmittance_nodes(
     # Light direction is the opposite of the sun direction
     light_dir = make_math_node(node_tree, "MULTIPLY", in1=sun_dir_y, in2=-1.0)
     acos_light_dir = make_math_node(node_tree, "ARCCOSINE", in1=light_dir)
-    mul_sun_offset = make_math_node(
-        node_tree, "MULTIPLY", in1=sun_offset, in2=math.pi / 9
+    # The offset is clamp(offset * pi / 9, 0, 2 * pi), which is
+    # 2 * pi * clamp(offset / 18, 0, 1). The clamp is free on a math node, and
+    # the 2 * pi is folded into the subtraction below.
+    sun_offset_fac = make_math_node(
+        node_tree, "MULTIPLY", in1=sun_offset, in2=1.0 / 18.0, clamp=True
     )
-    max_sun_offset = make_math_node(node_tree, "MAXIMUM", in1=mul_sun_offset, in2=0.0)
-    min_sun_offset = make_math_node(
-        node_tree, "MINIMUM", in1=max_sun_offset, in2=2 * math.pi
+    Z = make_math_node(
+        node_tree,
+        "MULTIPLY_ADD",
+        in1=sun_offset_fac,
+        in2=-2 * math.pi,
+        in3=acos_light_dir,
     )
-    Z = make_math_node(node_tree, "SUBTRACT", in1=acos_light_dir, in2=min_sun_offset)
     # Compute M (relative air mass)
     cosZ = make_math_node(node_tree, "COSINE", in1=Z)
-    degZ = make_math_node(node_tree, "MULTIPLY", in1=Z, in2=180.0 / math.pi)
-    deg_sub = make_math_node(node_tree, "SUBTRACT", in1=93.885, in2=degZ)
+    # 93.885 - Z in degrees
+    deg_sub = make_math_node(
+        node_tree, "MULTIPLY_ADD", in1=Z, in2=-180.0 / math.pi, in3=93.885
+    )
     deg_pow = make_math_node(node_tree, "POWER", in1=deg_sub, in2=-1.253)
-    deg_mul = make_math_node(node_tree, "MULTIPLY", in1=deg_pow, in2=0.15)
-    add_cosZ = make_math_node(node_tree, "ADD", in1=cosZ, in2=deg_mul)
+    add_cosZ = make_math_node(
+        node_tree, "MULTIPLY_ADD", in1=deg_pow, in2=0.15, in3=cosZ
+    )
     M = make_math_node(node_tree, "POWER", in1=add_cosZ, in2=-1.0)
     # Compute T_a (aerosol scattering contribution)
-    turbidity_mul = make_math_node(
-        node_tree, "MULTIPLY", in1=turbidity, in2=0.046083659
+    # -B, where B = turbidity * 0.046083659 - 0.045860261
+    negateB = make_math_node(
+        node_tree,
+        "MULTIPLY_ADD",
+        in1=turbidity,
+        in2=-0.046083659,
+        in3=0.045860261,
     )
-    B = make_math_node(node_tree, "SUBTRACT", in1=turbidity_mul, in2=0.045860261)
-    negateB = make_math_node(node_tree, "MULTIPLY", in1=B, in2=-1.0)
     negateBM = make_math_node(node_tree, "MULTIPLY", in1=negateB, in2=M)
-    wavelength_Ta = vector_power(node_tree, exponent=-1.3, vector=wavelength)
-    T_a = vector_scale(node_tree, vector=wavelength_Ta, scale=negateBM)
+    T_a = vector_scale(node_tree, vector=WAVELENGTH_AEROSOL, scale=negateBM)
     # Compute T_r (rayleigh scattering contribution)
-    wavelength_Tr = vector_power(node_tree, exponent=-4.08, vector=wavelength)
     rayleighM = make_math_node(node_tree, "MULTIPLY", in1=M, in2=-0.008735)
-    T_r = vector_scale(node_tree, vector=wavelength_Tr, scale=rayleighM)
+    T_r = vector_scale(node_tree, vector=WAVELENGTH_RAYLEIGH, scale=rayleighM)
     # Compute transmittance
     add_Ta_Tr = vector_add(node_tree, T_a, T_r)
     return vector_exp(node_tree, add_Ta_Tr)
 
 
 def make_value(node_tree: bpy.types.NodeTree, name: str) -> bpy.types.NodeSocketFloat:
-    node = node_tree.nodes.new("ShaderNodeValue")
-    node.name = name
+    # Sky values are set by node name (see update_sky_value), so there must
+    # only be one node per name in a tree. Reuse it if it's already been made,
+    # which also saves a node for values read in several places.
+    node = node_tree.nodes.get(name)
+    if node is None:
+        node = node_tree.nodes.new("ShaderNodeValue")
+        node.name = name
     return node.outputs[0]
 
 
 def make_vector_value(
     node_tree: bpy.types.NodeTree, name: str
 ) -> bpy.types.NodeSocketVector:
-    node = node_tree.nodes.new("ShaderNodeCombineXYZ")
-    node.name = name
+    # As in make_value, only make one node per name
+    node = node_tree.nodes.get(name)
+    if node is None:
+        node = node_tree.nodes.new("ShaderNodeCombineXYZ")
+        node.name = name
     return node.outputs[0]
 
 
@@ -212,19 +306,22 @@ def setup_rayleigh_mie_nodes(
         scale=rayleigh_multiplier,
     )
     mie_multiplier = make_value(node_tree, SKY_MIE_MULTIPLIER)
-    mie_turbidity = make_math_node(node_tree, "MULTIPLY", in1=turbidity, in2=6.544)
-    mie_turbidity = make_math_node(node_tree, "SUBTRACT", in1=mie_turbidity, in2=6.510)
-    mie_contribution_mixed = vector_scale(
+    mie_turbidity = make_math_node(
+        node_tree, "MULTIPLY_ADD", in1=turbidity, in2=6.544, in3=-6.510
+    )
+    # Both Mie terms scale a constant by turbidity and multiplier, so multiply
+    # the scalars once and scale each constant a single time.
+    mie_scale = make_math_node(
+        node_tree, "MULTIPLY", in1=mie_turbidity, in2=mie_multiplier
+    )
+    scaled_mie_mixed = vector_scale(
         node_tree,
         vector=(
             1.6213017e12 * 1.3634512 * 39.47842 * 9.99999983775159e-18,
             2.089874e12 * 1.3634512 * 39.47842 * 9.99999983775159e-18,
             2.9695295e12 * 1.3634512 * 39.47842 * 9.99999983775159e-18,
         ),
-        scale=mie_turbidity,
-    )
-    scaled_mie_mixed = vector_scale(
-        node_tree, vector=mie_contribution_mixed, scale=mie_multiplier
+        scale=mie_scale,
     )
     rayleigh_mie_mixed = vector_add(
         node_tree, v1=scaled_rayleigh_mixed, v2=scaled_mie_mixed
@@ -240,16 +337,18 @@ def setup_rayleigh_mie_nodes(
     cos_theta = make_math_node(node_tree, "MINIMUM", in1=cos_theta_dot, in2=0.0)
     cos_theta_sq = make_math_node(node_tree, "MULTIPLY", in1=cos_theta, in2=cos_theta)
     rayleigh_phase = make_math_node(node_tree, "ADD", in1=cos_theta_sq, in2=1.0)
-    rayleigh = vector_scale(
+    rayleigh_scale = make_math_node(
+        node_tree, "MULTIPLY", in1=rayleigh_multiplier, in2=rayleigh_phase
+    )
+    rayleigh_cont = vector_scale(
         node_tree,
         vector=(
             0.00004160824,
             0.000070361231,
             0.00014590107,
         ),
-        scale=rayleigh_multiplier,
+        scale=rayleigh_scale,
     )
-    rayleigh_cont = vector_scale(node_tree, vector=rayleigh, scale=rayleigh_phase)
     # Greenstein values
     greenstein_value = make_value(node_tree, SKY_GREENSTEIN_VALUE)
     greenstein_x = make_math_node(
@@ -260,10 +359,11 @@ def setup_rayleigh_mie_nodes(
     greenstein_z = make_math_node(node_tree, "MULTIPLY", in1=greenstein_value, in2=2.0)
     # Henyey-Greenstein phase function
     hg_denominator = make_math_node(
-        node_tree, "MULTIPLY", in1=greenstein_z, in2=cos_theta
-    )
-    hg_denominator = make_math_node(
-        node_tree, "ADD", in1=hg_denominator, in2=greenstein_y
+        node_tree,
+        "MULTIPLY_ADD",
+        in1=greenstein_z,
+        in2=cos_theta,
+        in3=greenstein_y,
     )
     hg_denominator = make_math_node(node_tree, "ABSOLUTE", in1=hg_denominator)
     hg_denominator = make_math_node(node_tree, "POWER", in1=hg_denominator, in2=-1.5)
@@ -271,17 +371,18 @@ def setup_rayleigh_mie_nodes(
         node_tree, "MULTIPLY", in1=hg_denominator, in2=greenstein_x
     )
     # Mie contributions
-    mie_contribution = vector_scale(
+    mie_phase_scale = make_math_node(
+        node_tree, "MULTIPLY", in1=mie_scale, in2=henyey_greenstein_phase
+    )
+    mie_cont = vector_scale(
         node_tree,
         vector=(
             2.3668638e12 * 0.217 * 39.47842 * 9.99999983775159e-18,
             3.0778702e12 * 0.217 * 39.47842 * 9.99999983775159e-18,
             4.4321331e12 * 0.217 * 39.47842 * 9.99999983775159e-18,
         ),
-        scale=mie_turbidity,
+        scale=mie_phase_scale,
     )
-    mie = vector_scale(node_tree, vector=mie_contribution, scale=mie_multiplier)
-    mie_cont = vector_scale(node_tree, vector=mie, scale=henyey_greenstein_phase)
     # Combined Rayleigh-Mie
     add_rayleigh_mie = vector_add(node_tree, v1=rayleigh_cont, v2=mie_cont)
     negate_scattering_depth = make_math_node(
@@ -299,6 +400,7 @@ def setup_rayleigh_mie_nodes(
 
 
 def recreate_internals() -> None:
+    invalidate_sky_trees()
     existing_tree = bpy.data.node_groups.get(SKY_NODE_TREE_NAME)
     if existing_tree is not None:
         setup_sky_node_tree(existing_tree)
@@ -411,6 +513,7 @@ class ShaderNodeRBRSky(bpy.types.ShaderNodeCustomGroup):
             self.node_tree = bpy.data.node_groups.new(
                 SKY_NODE_TREE_NAME, "ShaderNodeTree"
             )
+            invalidate_sky_trees()
             setup_sky_node_tree(self.node_tree)
         # The context passed in is 'None'
         bpy.context.scene.rbr_track_settings.update_sky_values()
@@ -426,6 +529,9 @@ def sun_direction_daemon(
     """A little daemon which watches for sun object updates and updates the
     shaders.
     """
+    global last_sun_dir
+    sun_type = RBRObjectType.SUN.name
+    tint_set = None
     for update in depsgraph.updates:
         if not update.is_updated_transform:
             continue
@@ -434,24 +540,41 @@ def sun_direction_daemon(
         obj = update.id
         # Check if we are a sun object
         object_settings: RBRObjectSettings = obj.rbr_object_settings
-        if object_settings.type != RBRObjectType.SUN.name:
+        if object_settings.type != sun_type:
             continue
-        if (
-            bpy.context.scene.rbr_track_settings.tint_set
-            not in object_settings.tint_sets
-        ):
+        # Only read when a sun has moved, most updates don't get this far
+        if tint_set is None:
+            tint_set = bpy.context.scene.rbr_track_settings.tint_set
+        if tint_set not in object_settings.tint_sets:
             continue
-        sun_dir = compute_left_hand_sun_dir(obj)
-        update_sky_vector(SKY_SUN_DIR, sun_dir.to_tuple())
+        sun_dir = compute_left_hand_sun_dir(obj).to_tuple()
+        # Forgets the last direction if trees have been appended or linked
+        check_sky_tree_keys()
+        # Moving the sun without turning it leaves the direction alone, and
+        # every write makes the shaders update.
+        if last_sun_dir is not None and all(
+            abs(a - b) < 1e-7 for (a, b) in zip(sun_dir, last_sun_dir)
+        ):
+            break
+        update_sky_vector(SKY_SUN_DIR, sun_dir)
+        last_sun_dir = sun_dir
         break
 
 
 def register() -> None:
     bpy.utils.register_class(ShaderNodeRBRSky)
     bpy.app.handlers.depsgraph_update_post.append(sun_direction_daemon)
+    for handlers in sky_tree_handlers:
+        handlers.append(invalidate_sky_trees)
 
 
 def unregister() -> None:
+    for handlers in sky_tree_handlers:
+        try:
+            handlers.remove(invalidate_sky_trees)
+        except ValueError:
+            pass
+    invalidate_sky_trees()
     try:
         bpy.app.handlers.depsgraph_update_post.remove(sun_direction_daemon)
     except ValueError:
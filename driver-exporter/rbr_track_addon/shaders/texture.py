@@ -16,6 +16,7 @@ from ..physical_material_editor.properties import (
     RBRPropertyNodePointer,
     RBRMaterialMaps,
     RBRFallbackMaterials,
+    extend_material_maps,
 )
 from .utils import linear_to_srgb
 
@@ -65,9 +66,10 @@ def recreate_internals(
             old_internal.override_mip_levels
         )
         node_tree.nodes["internal"].mip_levels = old_internal.mip_levels
-        for original in old_internal.material_maps:
-            new = node_tree.nodes["internal"].material_maps.add()
-            new.copy(original)
+        extend_material_maps(
+            node_tree.nodes["internal"].material_maps,
+            old_internal.material_maps,
+        )
         node_tree.nodes.remove(old_internal)
     for name, image in images.items():
         node_tree.nodes[name].image = image
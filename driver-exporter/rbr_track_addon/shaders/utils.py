@@ -1,10 +1,23 @@
 """Shader node helper functions.
 """
 
-from typing import Optional, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import bpy  # type: ignore
 
+# The node builders check for sockets on every input. Look the class up once,
+# since attribute access on bpy.types goes through the RNA registry.
+NodeSocket = bpy.types.NodeSocket
+
+
+def node_materials() -> List[Tuple[bpy.types.Material, bpy.types.NodeTree]]:
+    """All materials which use nodes, along with their node trees"""
+    return [
+        (material, material.node_tree)
+        for material in bpy.data.materials
+        if material.use_nodes
+    ]
+
 
 def make_math_node(
     node_tree: bpy.types.NodeTree,
@@ -17,30 +30,18 @@ def make_math_node(
     node = node_tree.nodes.new("ShaderNodeMath")
     node.operation = operation
     node.use_clamp = clamp
-    if isinstance(in1, float):
-        node.inputs[0].default_value = in1
-    else:
-        node_tree.links.new(
-            node.inputs[0],
-            in1,
-        )
-    if in2 is not None:
-        if isinstance(in2, float):
-            node.inputs[1].default_value = in2
+    inputs = node.inputs
+    for index, value in ((0, in1), (1, in2), (2, in3)):
+        if value is None:
+            continue
+        if isinstance(value, float):
+            inputs[index].default_value = value
         else:
             node_tree.links.new(
-                node.inputs[1],
-                in2,
+                inputs[index],
+                value,
             )
-    if in3 is not None:
-        if isinstance(in3, float):
-            node.inputs[1].default_value = in3
-        else:
-            node_tree.links.new(
-                node.inputs[2],
-                in3,
-            )
-    return node.outputs["Value"]
+    return node.outputs[0]
 
 
 def mix_rgb(
@@ -55,28 +56,40 @@ def mix_rgb(
     node = node_tree.nodes.new("ShaderNodeMixRGB")
     node.blend_type = blend_type
     node.use_clamp = clamp
-    if isinstance(fac, bpy.types.NodeSocket):
-        node_tree.links.new(
-            node.inputs["Fac"],
-            fac,
-        )
-    else:
-        node.inputs["Fac"].default_value = fac
-    if isinstance(a, bpy.types.NodeSocket):
-        node_tree.links.new(
-            node.inputs["Color1"],
-            a,
-        )
-    else:
-        node.inputs["Color1"].default_value = a
-    if isinstance(b, bpy.types.NodeSocket):
-        node_tree.links.new(
-            node.inputs["Color2"],
-            b,
-        )
-    else:
-        node.inputs["Color2"].default_value = b
-    return node.outputs["Color"]
+    # Sockets by index are cheaper to find than by name: Fac, Color1, Color2
+    inputs = node.inputs
+    for index, value in ((0, fac), (1, a), (2, b)):
+        if isinstance(value, NodeSocket):
+            node_tree.links.new(
+                inputs[index],
+                value,
+            )
+        else:
+            inputs[index].default_value = value
+    return node.outputs[0]
+
+
+def mix_value(
+    node_tree: bpy.types.NodeTree,
+    fac: Union[float, bpy.types.NodeSocket],
+    a: Union[float, bpy.types.NodeSocket],
+    b: Union[float, bpy.types.NodeSocket],
+) -> bpy.types.NodeSocket:
+    """Linear interpolation between two values according to some factor"""
+    node = node_tree.nodes.new("ShaderNodeMix")
+    node.data_type = "FLOAT"
+    # The float sockets share their names with those of the other data types,
+    # so go by index.
+    inputs = node.inputs
+    for index, value in ((0, fac), (2, a), (3, b)):
+        if isinstance(value, NodeSocket):
+            node_tree.links.new(
+                inputs[index],
+                value,
+            )
+        else:
+            inputs[index].default_value = value
+    return node.outputs[0]
 
 
 def srgb_to_linear(
@@ -84,35 +97,23 @@ def srgb_to_linear(
     input: Union[str, bpy.types.NodeSocket],
 ) -> bpy.types.NodeSocket:
     # TODO this isn't perfect, it needs a where clause
-    separate = node_tree.nodes.new("ShaderNodeSeparateRGB")
+    # ((c + 0.055) / 1.055) ^ 2.4 for each channel. Vector math and gamma
+    # nodes work on all three channels at once, so this takes two nodes
+    # rather than a separate, a combine and three math nodes per channel.
+    scale = node_tree.nodes.new("ShaderNodeVectorMath")
+    scale.operation = "MULTIPLY_ADD"
     if isinstance(input, str):
-        separate.name = input
-    elif isinstance(input, bpy.types.NodeSocket):
-        node_tree.links.new(input, separate.inputs[0])
+        scale.name = input
+    elif isinstance(input, NodeSocket):
+        node_tree.links.new(input, scale.inputs[0])
     else:
         raise NotImplementedError
-    combine = node_tree.nodes.new("ShaderNodeCombineRGB")
-    for i in [0, 1, 2]:
-        add = make_math_node(
-            node_tree,
-            "ADD",
-            separate.outputs[i],
-            0.055,
-        )
-        divide = make_math_node(
-            node_tree,
-            "DIVIDE",
-            add,
-            1.055,
-        )
-        power = make_math_node(
-            node_tree,
-            "POWER",
-            divide,
-            2.4,
-        )
-        node_tree.links.new(power, combine.inputs[i])
-    return combine.outputs[0]
+    scale.inputs[1].default_value = (1 / 1.055, 1 / 1.055, 1 / 1.055)
+    scale.inputs[2].default_value = (0.055 / 1.055, 0.055 / 1.055, 0.055 / 1.055)
+    gamma = node_tree.nodes.new("ShaderNodeGamma")
+    node_tree.links.new(scale.outputs["Vector"], gamma.inputs["Color"])
+    gamma.inputs["Gamma"].default_value = 2.4
+    return gamma.outputs["Color"]
 
 
 def linear_to_srgb(
@@ -123,7 +124,7 @@ def linear_to_srgb(
     separate = node_tree.nodes.new("ShaderNodeSeparateRGB")
     if isinstance(input, str):
         separate.name = input
-    elif isinstance(input, bpy.types.NodeSocket):
+    elif isinstance(input, NodeSocket):
         node_tree.links.new(input, separate.inputs[0])
     else:
         raise NotImplementedError
@@ -187,11 +188,11 @@ def vector_scale(
 ) -> bpy.types.NodeSocketVector:
     scale_node = node_tree.nodes.new("ShaderNodeVectorMath")
     scale_node.operation = "SCALE"
-    if isinstance(vector, bpy.types.NodeSocket):
+    if isinstance(vector, NodeSocket):
         node_tree.links.new(vector, scale_node.inputs[0])
     else:
         scale_node.inputs[0].default_value = vector
-    if isinstance(scale, bpy.types.NodeSocket):
+    if isinstance(scale, NodeSocket):
         node_tree.links.new(scale, scale_node.inputs["Scale"])
     else:
         scale_node.inputs["Scale"].default_value = scale
@@ -230,11 +231,11 @@ def vector_math(
 ) -> bpy.types.NodeSocketVector:
     add = node_tree.nodes.new("ShaderNodeVectorMath")
     add.operation = operation
-    if isinstance(v1, bpy.types.NodeSocket):
+    if isinstance(v1, NodeSocket):
         node_tree.links.new(v1, add.inputs[0])
     else:
         add.inputs[0].default_value = v1
-    if isinstance(v2, bpy.types.NodeSocket):
+    if isinstance(v2, NodeSocket):
         node_tree.links.new(v2, add.inputs[1])
     else:
         add.inputs[1].default_value = v2
@@ -249,11 +250,11 @@ def vector_math_float(
 ) -> bpy.types.NodeSocketVector:
     add = node_tree.nodes.new("ShaderNodeVectorMath")
     add.operation = operation
-    if isinstance(v1, bpy.types.NodeSocket):
+    if isinstance(v1, NodeSocket):
         node_tree.links.new(v1, add.inputs[0])
     else:
         add.inputs[0].default_value = v1
-    if isinstance(v2, bpy.types.NodeSocket):
+    if isinstance(v2, NodeSocket):
         node_tree.links.new(v2, add.inputs[1])
     else:
         add.inputs[1].default_value = v2
@@ -1,6 +1,6 @@
 import bpy  # type: ignore
 
-from typing import List, Optional, Set, Tuple
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
 
 from rbr_track_formats.mat import SurfaceType, SurfaceAge
 from rbr_track_formats.track_settings import (
@@ -483,6 +483,16 @@ def setup_rbr_world(world: bpy.types.World) -> None:
     node_tree.links.new(world_output.inputs["Surface"], sky_node.outputs["Surface"])
 
 
+# Enum items for the active surface type, keyed by the selected surface types.
+# Blender needs us to keep a reference to items returned from callbacks, and
+# keeping them around means they aren't rebuilt every time the enum is read.
+surface_type_items_cache: Dict[FrozenSet[str], List[Tuple[str, str, str, int]]] = {}
+
+SURFACE_AGE_ITEMS: List[Tuple[str, str, str, int]] = [
+    (s.name, s.pretty(), s.description(), s.value) for s in SurfaceAge
+]
+
+
 class RBRTrackSettings(bpy.types.PropertyGroup):
     def __update_surface_type__(self, context: bpy.types.Context) -> None:
         # Prevent users from disabling all surface types.
@@ -518,12 +528,18 @@ class RBRTrackSettings(bpy.types.PropertyGroup):
     def __surface_type_items__(
         self, context: bpy.types.Context
     ) -> List[Tuple[str, str, str, int]]:
-        return [
-            (s.name, s.pretty(), s.description(), s.value)
-            # Constructed in this roundabout way to preserve natural order
-            for s in SurfaceType
-            if s in self.selected_surface_types()
-        ]
+        key = frozenset(self.surface_types)
+        items = surface_type_items_cache.get(key)
+        if items is None:
+            selected = self.selected_surface_types()
+            items = [
+                (s.name, s.pretty(), s.description(), s.value)
+                # Constructed in this roundabout way to preserve natural order
+                for s in SurfaceType
+                if s in selected
+            ]
+            surface_type_items_cache[key] = items
+        return items
 
     active_surface_type: bpy.props.EnumProperty(  # type: ignore
         name="Surface Type",
@@ -538,7 +554,7 @@ class RBRTrackSettings(bpy.types.PropertyGroup):
     def __surface_age_items__(
         self, context: bpy.types.Context
     ) -> List[Tuple[str, str, str, int]]:
-        return [(s.name, s.pretty(), s.description(), s.value) for s in SurfaceAge]
+        return SURFACE_AGE_ITEMS
 
     active_surface_age: bpy.props.EnumProperty(  # type: ignore
         name="Surface Age",